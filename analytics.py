@@ -0,0 +1,129 @@
+#!/usr/bin/env python -OO
+# -*- coding: utf-8 -*-
+
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+# The indexes the usual joins and lookups need, on top of the primary keys
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS clues_category_id ON clues(category_id);",
+    "CREATE INDEX IF NOT EXISTS clues_answer_player_id ON clues(answer_player_id) WHERE answer_player_id IS NOT NULL;",
+    "CREATE INDEX IF NOT EXISTS clues_daily_double ON clues(game_id) WHERE is_daily_double = 1;",
+    "CREATE INDEX IF NOT EXISTS clue_wrong_answers_player_id ON clue_wrong_answers(player_id);",
+    "CREATE INDEX IF NOT EXISTS final_jeopardy_answers_player_id ON final_jeopardy_answers(player_id);",
+    "CREATE INDEX IF NOT EXISTS players_nickname ON players(nickname);",
+    "CREATE INDEX IF NOT EXISTS games_air_date ON games(air_date);",
+]
+
+# Rebuilt from scratch on every run, so they can't go stale
+SUMMARIES = [
+    ("player_stats", """CREATE TABLE player_stats(
+        player_id INTEGER PRIMARY KEY,
+        name TEXT,
+        games INTEGER,
+        wins INTEGER,
+        total_winnings INTEGER,
+        coryat_average REAL,
+        daily_doubles INTEGER,
+        daily_doubles_right INTEGER,
+        final_jeopardys INTEGER,
+        final_jeopardys_right INTEGER
+    );""", """INSERT INTO player_stats
+    WITH played AS (
+        SELECT player_id, count(*) AS games, sum(is_winner) AS wins,
+            -- Only the winners keep their score
+            sum(CASE WHEN is_winner THEN final_score ELSE 0 END) AS total_winnings,
+            avg(coryat_score) AS coryat_average
+        FROM (
+            -- Everyone tied for the top score wins, if it's above zero (tied
+            -- players share the lower place, so place = 1 would miss them)
+            SELECT *, coalesce(final_score = max(final_score) OVER (PARTITION BY game_id) AND final_score > 0, 0) AS is_winner
+            FROM game_players
+        ) GROUP BY player_id
+    ), daily_doubles AS (
+        SELECT player_id, count(*) AS attempts, sum(is_right) AS right FROM (
+            SELECT answer_player_id AS player_id, 1 AS is_right FROM clues
+            WHERE is_daily_double = 1 AND answer_player_id IS NOT NULL
+            UNION ALL
+            SELECT player_id, 0 FROM clue_wrong_answers
+            JOIN clues ON clue_wrong_answers.clue_id = clues.clue_id
+            WHERE is_daily_double = 1
+        ) GROUP BY player_id
+    ), finals AS (
+        SELECT player_id, count(*) AS attempts, sum(is_correct) AS right
+        FROM final_jeopardy_answers GROUP BY player_id
+    )
+    SELECT players.player_id, name, coalesce(games, 0), coalesce(wins, 0),
+        coalesce(total_winnings, 0), coryat_average,
+        coalesce(daily_doubles.attempts, 0), coalesce(daily_doubles.right, 0),
+        coalesce(finals.attempts, 0), coalesce(finals.right, 0)
+    FROM players
+    LEFT JOIN played ON played.player_id = players.player_id
+    LEFT JOIN daily_doubles ON daily_doubles.player_id = players.player_id
+    LEFT JOIN finals ON finals.player_id = players.player_id;"""),
+    ("category_stats", """CREATE TABLE category_stats(
+        category_id INTEGER PRIMARY KEY,
+        category TEXT,
+        clues INTEGER,
+        games INTEGER,
+        first_air_date TEXT,
+        last_air_date TEXT
+    );""", """INSERT INTO category_stats
+    SELECT categories.category_id, category, count(*), count(DISTINCT clues.game_id),
+        min(air_date), max(air_date)
+    FROM clues
+    JOIN categories ON clues.category_id = categories.category_id
+    JOIN games ON clues.game_id = games.game_id
+    GROUP BY categories.category_id;"""),
+    ("season_values", """CREATE TABLE season_values(
+        season INTEGER,
+        round INTEGER,
+        value INTEGER,
+        clues INTEGER,
+        daily_doubles INTEGER,
+        PRIMARY KEY(season, round, value)
+    );""", """INSERT INTO season_values
+    -- Season 1 began in September 1984
+    SELECT CAST(substr(air_date, 1, 4) AS INTEGER) - 1984 + (substr(air_date, 6, 2) >= '09') AS season,
+        round, value, count(*), sum(is_daily_double)
+    FROM clues
+    JOIN games ON clues.game_id = games.game_id
+    WHERE value IS NOT NULL
+    GROUP BY season, round, value;"""),
+]
+
+
+def main(args):
+    if not os.path.exists(args.database):
+        print("The specified database does not exist.")
+        sys.exit(1)
+    with sqlite3.connect(args.database) as sql:
+        build(sql)
+
+
+def build(sql):
+    """Creates the indexes and rebuilds the summary tables, in one transaction."""
+    start = time.perf_counter()
+    with sql:
+        for index in INDEXES:
+            sql.execute(index)
+        for table, create, insert in SUMMARIES:
+            sql.execute("DROP TABLE IF EXISTS %s;" % table)
+            sql.execute(create)
+            sql.execute(insert)
+    # Lets the query planner pick between the new indexes
+    sql.execute("ANALYZE;")
+    print("Built the indexes and summary tables in %.1fs" % (time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Index the J! Archive database and build its summary tables: player_stats, category_stats and season_values.")
+    parser.add_argument("-f", "--filename", dest="database",
+                        metavar="<filename>",
+                        help="the SQLite database to build them in",
+                        default="output/database.db")
+    main(parser.parse_args())
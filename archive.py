@@ -0,0 +1,179 @@
+#!/usr/bin/env python -OO
+# -*- coding: utf-8 -*-
+
+from glob import glob
+
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+import time
+import zlib
+
+
+def open_store(path):
+    """Opens the game archive at path.
+
+    A path ending in .db is a page store, a single SQLite file holding every
+    game compressed; anything else is a folder of N.html files.
+    """
+    if path.endswith(".db"):
+        return PageStore(path)
+    return FolderStore(path)
+
+
+class FolderStore(object):
+    """Games saved one uncompressed N.html file per game id."""
+
+    def __init__(self, folder):
+        self.path = folder
+        self.manifest_path = os.path.join(folder, "manifest.json")
+
+    def create(self):
+        if not os.path.isdir(self.path):
+            print("Making %s" % self.path)
+            os.mkdir(self.path)
+
+    def exists(self):
+        return os.path.isdir(self.path)
+
+    def file_name(self, gid):
+        return os.path.join(self.path, "%s.html" % gid)
+
+    def ids(self):
+        """Returns the game ids in the archive, in order."""
+        ids = []
+        for file_name in glob(os.path.join(self.path, "*.html")):
+            ids.append(int(os.path.basename(file_name).replace(".html", "")))
+        return sorted(ids)
+
+    def __contains__(self, gid):
+        return os.path.exists(self.file_name(gid))
+
+    def read(self, gid):
+        with open(self.file_name(gid)) as f:
+            return f.read()
+
+    def write(self, gid, html):
+        try:
+            with open(self.file_name(gid), 'w') as f:
+                f.write(html)
+        except IOError:
+            print("Couldn't write to file %s" % self.file_name(gid))
+
+    def state(self, gid, loaded=None):
+        """Returns the (size, mtime, hash) of a game.
+
+        Returns None instead when the size and mtime match the loaded state,
+        so unchanged files don't have to be read.
+        """
+        stat = os.stat(self.file_name(gid))
+        if loaded and tuple(loaded[:2]) == (stat.st_size, stat.st_mtime_ns):
+            return None
+        with open(self.file_name(gid), "rb") as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        return (stat.st_size, stat.st_mtime_ns, digest)
+
+    def close(self):
+        pass
+
+
+class PageStore(object):
+    """Games saved zlib-compressed in one SQLite file, by game id.
+
+    The pages compress to around a tenth of their size, and reading one is
+    a primary key lookup instead of a file open.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.manifest_path = os.path.splitext(path)[0] + ".manifest.json"
+        self.sql = None
+
+    def __getstate__(self):
+        # Sent to worker processes without the connection, they open their own
+        state = dict(self.__dict__)
+        state["sql"] = None
+        return state
+
+    def connection(self):
+        # Connections aren't shared with forked worker processes
+        if self.sql is None or self.pid != os.getpid():
+            self.sql = sqlite3.connect(self.path)
+            self.pid = os.getpid()
+            self.sql.execute("""CREATE TABLE IF NOT EXISTS pages(
+                game_id INTEGER PRIMARY KEY,
+                html BLOB,
+                size INTEGER,
+                modified INTEGER,
+                hash TEXT
+            )""")
+        return self.sql
+
+    def create(self):
+        self.connection()
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def ids(self):
+        """Returns the game ids in the archive, in order."""
+        return [row[0] for row in self.connection().execute("SELECT game_id FROM pages ORDER BY game_id;")]
+
+    def __contains__(self, gid):
+        return self.connection().execute("SELECT 1 FROM pages WHERE game_id = ?;", (gid, )).fetchone() is not None
+
+    def read(self, gid):
+        row = self.connection().execute("SELECT html FROM pages WHERE game_id = ?;", (gid, )).fetchone()
+        if row is None:
+            raise KeyError(gid)
+        return zlib.decompress(row[0]).decode("utf-8")
+
+    def write(self, gid, html):
+        data = html.encode("utf-8")
+        with self.connection() as sql:
+            sql.execute("INSERT OR REPLACE INTO pages VALUES(?, ?, ?, ?, ?);",
+                        (gid, zlib.compress(data, 9), len(data), time.time_ns(), hashlib.sha1(data).hexdigest(), ))
+
+    def state(self, gid, loaded=None):
+        """Returns the (size, mtime, hash) of a game, or None if it's unchanged."""
+        state = self.connection().execute("SELECT size, modified, hash FROM pages WHERE game_id = ?;", (gid, )).fetchone()
+        if loaded and tuple(loaded[:2]) == tuple(state[:2]):
+            return None
+        return tuple(state)
+
+    def close(self):
+        if self.sql is not None:
+            self.sql.close()
+            self.sql = None
+
+
+def main(args):
+    """Copies every game from one archive to another, e.g. into a page store."""
+    source = open_store(args.source)
+    if not source.exists():
+        print("The specified archive does not exist.")
+        sys.exit(1)
+    destination = open_store(args.destination)
+    destination.create()
+    for gid in source.ids():
+        destination.write(gid, source.read(gid))
+    if os.path.exists(source.manifest_path):
+        with open(source.manifest_path) as f:
+            manifest = f.read()
+        with open(destination.manifest_path, 'w') as f:
+            f.write(manifest)
+    destination.close()
+    print("Copied", len(source.ids()), "games")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Copy a J! Archive game archive, e.g. from a folder of game files to a compressed page store.",
+        usage="%(prog)s <source> <destination>")
+    parser.add_argument("source",
+                        help="the archive to copy: a folder of N.html files or a .db page store")
+    parser.add_argument("destination",
+                        help="the archive to copy to, a .db page store is created if it doesn't exist")
+    main(parser.parse_args())
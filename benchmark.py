@@ -0,0 +1,371 @@
+#!/usr/bin/env python -OO
+# -*- coding: utf-8 -*-
+
+from contextlib import contextmanager
+
+import archive
+import argparse
+import io
+import json
+import platform
+import regex
+import os
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import lxml.html
+
+import parser
+
+# What the parser calls on each pattern, search unless listed here
+PATTERN_METHODS = {
+    "answer_table": "findall",
+    "name_answer": "findall",
+    "parens": "findall",
+}
+
+# The parser functions each stage of parsing a game is timed in, by engine
+STAGES = {
+    "bs4": [
+        ("html parse", "read_soup"),
+        ("parse_players", "parse_players"),
+        ("parse_round", "parse_round"),
+        ("final round", "parse_final_round"),
+    ],
+    "lxml-fast": [
+        ("html parse", "read_tree"),
+        ("parse_players", "parse_players_lxml"),
+        ("parse_round", "parse_round_lxml"),
+        ("final round", "parse_final_round_lxml"),
+    ],
+}
+
+# What parser.py --help can spend importing modules, best of the runs
+STARTUP_BUDGET_MS = 100
+# Only the runs that parse games should import these
+HEAVY_MODULES = ["bs4", "lxml", "numpy", "regex", "scipy"]
+
+# Next to this script, wherever it's run from
+FOLDER = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_FILE = os.path.join(FOLDER, "benchmark-sample.txt")
+BASELINE_FILE = os.path.join(FOLDER, "benchmark-baseline.json")
+
+# The recursive pattern parser.paren_groups replaced, timed for comparison
+RECURSIVE_WRONG_ANSWER = regex.compile(r"\((([^()]|(?R))*)\)")
+
+
+def main(args):
+    """Runs the benchmark given on the command line."""
+    if args.command == "startup":
+        # Doesn't need the archive
+        startup(args)
+        return
+    store = archive.open_store(args.dir)
+    if not store.exists():
+        print("The specified archive does not exist.")
+        sys.exit(1)
+    args.func(store, store.ids()[:args.num_of_files], args)
+
+
+def sample(store, ids, args):
+    """Picks the games the parse benchmark runs over and saves their ids.
+
+    Games are taken at even steps through the archive, so every era of page
+    layout is in the sample, along with the first few games with no final
+    round, with Triple Stumpers and with other than three players.
+    """
+    step = max(1, len(ids) // args.size)
+    picked = dict((gid, "era") for gid in ids[::step][:args.size])
+    edge_cases = {"no final round": [], "triple stumper": [], "player count": []}
+    for gid in ids:
+        if gid in picked:
+            continue
+        html = store.read(gid)
+        cases = []
+        if 'class="final_round"' not in html:
+            cases.append("no final round")
+        if "Triple Stumper" in html:
+            cases.append("triple stumper")
+        if html.count('class="contestants"') != 3:
+            cases.append("player count")
+        for case in cases:
+            if len(edge_cases[case]) < args.edge_cases:
+                edge_cases[case].append(gid)
+                picked[gid] = case
+    with open(args.sample, "w") as f:
+        f.write("# The games benchmark.py parse runs over, picked by benchmark.py sample\n")
+        for gid in sorted(picked):
+            f.write("%d  # %s\n" % (gid, picked[gid]))
+    print("Saved %d game ids to %s" % (len(picked), args.sample))
+
+
+def load_sample(path):
+    """Returns the game ids listed in the sample file, exiting if there isn't one."""
+    if not os.path.exists(path):
+        print("There's no sample file %s, run `benchmark.py sample` first." % path)
+        sys.exit(1)
+    with open(path) as f:
+        return [int(line.split("#")[0]) for line in f if line.split("#")[0].strip()]
+
+
+@contextmanager
+def timed_stages(engine, times):
+    """Wraps the parser's stage functions to add up the time spent in each."""
+    def timed(stage, func):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                times[stage] += time.perf_counter() - start
+        return wrapper
+
+    originals = [(name, getattr(parser, name)) for _, name in STAGES[engine]]
+    for stage, name in STAGES[engine]:
+        times[stage] = 0.0
+        setattr(parser, name, timed(stage, getattr(parser, name)))
+    try:
+        yield times
+    finally:
+        for name, func in originals:
+            setattr(parser, name, func)
+
+
+def parse_run(pages, engine, batch_size):
+    """Parses and inserts the pages once, returning the time of each stage."""
+    times = {}
+    with tempfile.TemporaryDirectory() as folder:
+        sql = sqlite3.connect(folder + "/benchmark.db")
+        parser.create_schema(sql)
+        writer = parser.Writer(sql, batch_size)
+        with timed_stages(engine, times):
+            insert = 0.0
+            start = time.perf_counter()
+            for gid, html in pages:
+                game = parser.ENGINES[engine](io.StringIO(html), gid)
+                insert_start = time.perf_counter()
+                writer.insert_game(game)
+                insert += time.perf_counter() - insert_start
+            insert_start = time.perf_counter()
+            writer.flush()
+            insert += time.perf_counter() - insert_start
+            times["total"] = time.perf_counter() - start
+        times["sqlite insert"] = insert
+        sql.close()
+    return times
+
+
+def parse(store, ids, args):
+    """Times parsing and inserting the sample games, stage by stage.
+
+    The pages are read into memory first, so only the parser is timed. The
+    fastest of the runs is reported, and compared to the baseline if there
+    is one.
+    """
+    sample_ids = load_sample(args.sample)
+    missing = [gid for gid in sample_ids if gid not in store]
+    if missing:
+        print("The archive is missing the sample games", ", ".join(map(str, missing)))
+        sys.exit(1)
+    pages = [(gid, store.read(gid)) for gid in sample_ids]
+
+    runs = [parse_run(pages, args.engine, args.batch_size) for _ in range(args.repeat)]
+    best = min(runs, key=lambda times: times["total"])
+    result = {
+        "engine": args.engine,
+        "python": platform.python_version(),
+        "games": len(pages),
+        "games_per_second": len(pages) / best["total"],
+        # Kilobytes on Linux
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "seconds": best,
+    }
+
+    baseline = None
+    if not args.save_baseline:
+        try:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        except (IOError, ValueError):
+            pass
+    if baseline and baseline["engine"] != args.engine:
+        baseline = None
+
+    print("%d games with %s: %.1f games/s, peak RSS %.1f MB" % (result["games"], args.engine, result["games_per_second"], result["peak_rss_kb"] / 1024.0))
+    print("%-16s %10s %10s %10s" % ("stage", "total ms", "ms/game", "baseline"))
+    regressions = []
+    for stage in [stage for stage, _ in STAGES[args.engine]] + ["sqlite insert", "total"]:
+        elapsed = best[stage]
+        change = ""
+        if baseline and stage in baseline["seconds"]:
+            ratio = elapsed / baseline["seconds"][stage] - 1
+            change = "%+.1f%%" % (ratio * 100)
+            # Stages this short are mostly noise
+            if ratio * 100 > args.tolerance and baseline["seconds"][stage] >= 0.05 * baseline["seconds"]["total"]:
+                regressions.append(stage)
+        print("%-16s %10.2f %10.3f %10s" % (stage, elapsed * 1000, elapsed * 1000 / len(pages), change))
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(result, f, indent=1, sort_keys=True)
+        print("Saved the baseline to", args.baseline)
+    if regressions:
+        print("Slower than the baseline by more than %s%%: %s" % (args.tolerance, ", ".join(regressions)))
+        sys.exit(1)
+
+
+def startup(args):
+    """Checks what parser.py --help imports, and how long that takes, against the budget.
+
+    The import time is the total of the top-level imports -X importtime
+    reports, so it leaves out the interpreter starting up.
+    """
+    script = os.path.join(FOLDER, "parser.py")
+    best = None
+    for _ in range(args.repeat):
+        output = subprocess.run([sys.executable, "-X", "importtime", script, "--help"],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                universal_newlines=True, check=True).stderr
+        imported = set()
+        total = 0
+        for line in output.splitlines():
+            if not line.startswith("import time:") or "|" not in line or "self [us]" in line:
+                continue
+            _, cumulative, name = line.split("|")
+            imported.add(name.strip().split(".")[0])
+            if not name.startswith("  "):
+                total += int(cumulative)
+        best = total if best is None else min(best, total)
+
+    heavy = sorted(imported.intersection(HEAVY_MODULES))
+    print("parser.py --help imports in %.1f ms (budget %d ms)" % (best / 1000.0, args.budget))
+    if heavy:
+        print("parser.py --help imports", ", ".join(heavy))
+    if heavy or best / 1000.0 > args.budget:
+        sys.exit(1)
+
+
+def pattern_inputs(store, ids):
+    """Collects the strings each of the parser's patterns is run against."""
+    inputs = dict((name, []) for name in parser.PATTERN_SOURCES)
+    inputs["wrong_answer"] = []
+    for gid in ids:
+        doc = lxml.html.document_fromstring(store.read(gid))
+        for p in parser.CONTESTANTS(doc):
+            inputs["contestant"].append(parser.contestant_description(p))
+        for h3 in parser.H3S(doc):
+            string = parser.tag_string(h3)
+            if string is not None:
+                for name in ("scores_first_break", "scores_jeopardy", "scores_double_jeopardy", "scores_final"):
+                    inputs[name].append(string)
+        # BeautifulSoup tries the class patterns on every class of every cell
+        for td in doc.iter("td"):
+            for name in ("score_class", "clue_value_class", "clue_order_number_class"):
+                inputs[name].extend(td.get("class", "").split())
+        for div in parser.MOUSEOVER(doc):
+            answer_source = div.get("onmouseover").replace("\\'", "'")
+            inputs["answer_table"].append(answer_source)
+            answer_table = parser.PATTERNS["answer_table"].findall(answer_source)
+            answer_table_text = str(answer_table[0]) if len(answer_table) > 0 else ""
+            inputs["wrong_answer"].append(answer_table_text)
+            inputs["parens"].append(answer_table_text)
+            inputs["name_answer"].extend(parser.paren_groups(answer_table_text))
+    return inputs
+
+
+def best_time(func, strings, repeat):
+    """Returns the fastest of `repeat` runs of func over all the strings."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for string in strings:
+            func(string)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def patterns(store, ids, args):
+    """Reports what each of the parser's patterns costs over the games."""
+    print("Collecting pattern inputs from", len(ids), "games")
+    inputs = pattern_inputs(store, ids)
+
+    rows = []
+    for name in sorted(parser.PATTERN_SOURCES):
+        pattern = parser.PATTERNS[name]
+        method = getattr(pattern, PATTERN_METHODS.get(name, "search"))
+        rows.append((name, len(inputs[name]), best_time(method, inputs[name], args.repeat)))
+    rows.append(("wrong_answer (paren_groups)", len(inputs["wrong_answer"]), best_time(parser.paren_groups, inputs["wrong_answer"], args.repeat)))
+    rows.append(("wrong_answer (recursive regex)", len(inputs["wrong_answer"]), best_time(lambda s: list(RECURSIVE_WRONG_ANSWER.finditer(s)), inputs["wrong_answer"], args.repeat)))
+
+    print("%-32s %10s %12s %10s" % ("pattern", "calls", "total ms", "us/call"))
+    for name, calls, elapsed in rows:
+        print("%-32s %10d %12.2f %10.2f" % (name, calls, elapsed * 1000, elapsed * 1e6 / calls if calls else 0))
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description="Benchmark the J! Archive parser.")
+    arg_parser.add_argument("-d", "--dir", dest="dir", metavar="<folder>",
+                            help="the directory containing the game files, or a .db page store",
+                            default="j-archive")
+    arg_parser.add_argument("-n", "--number-of-files", dest="num_of_files",
+                            metavar="<number>", help="the number of files to use",
+                            type=int)
+    subparsers = arg_parser.add_subparsers(dest="command", required=True)
+    patterns_parser = subparsers.add_parser(
+        "patterns", help="time each of the parser's regular expressions")
+    patterns_parser.add_argument("-r", "--repeat", dest="repeat",
+                                 metavar="<number>", type=int, default=3,
+                                 help="the number of timing runs, the fastest is reported")
+    patterns_parser.set_defaults(func=patterns)
+    startup_parser = subparsers.add_parser(
+        "startup", help="check parser.py starts without the parsing libraries, within the time budget")
+    startup_parser.add_argument("-r", "--repeat", dest="repeat",
+                                metavar="<number>", type=int, default=5,
+                                help="the number of runs, the fastest is reported")
+    startup_parser.add_argument("--budget", dest="budget", metavar="<ms>",
+                                type=float, default=STARTUP_BUDGET_MS,
+                                help="the most milliseconds the imports can take")
+    startup_parser.set_defaults(func=startup)
+    sample_parser = subparsers.add_parser(
+        "sample", help="pick the games the parse benchmark runs over")
+    sample_parser.add_argument("-s", "--sample", dest="sample",
+                               metavar="<filename>", default=SAMPLE_FILE,
+                               help="the file to save the game ids to")
+    sample_parser.add_argument("--size", dest="size", metavar="<number>",
+                               type=int, default=20,
+                               help="the number of games taken at even steps through the archive")
+    sample_parser.add_argument("--edge-cases", dest="edge_cases",
+                               metavar="<number>", type=int, default=3,
+                               help="the number of games of each edge case added")
+    sample_parser.set_defaults(func=sample)
+    parse_parser = subparsers.add_parser(
+        "parse", help="time each stage of parsing and inserting the sample games")
+    parse_parser.add_argument("-s", "--sample", dest="sample",
+                              metavar="<filename>", default=SAMPLE_FILE,
+                              help="the file listing the game ids to parse")
+    parse_parser.add_argument("-e", "--engine", dest="engine",
+                              choices=sorted(parser.ENGINES), default="bs4",
+                              help="the parsing engine to time")
+    parse_parser.add_argument("-b", "--batch-size", dest="batch_size",
+                              metavar="<number>", type=int, default=100,
+                              help="the number of games written per transaction")
+    parse_parser.add_argument("-r", "--repeat", dest="repeat",
+                              metavar="<number>", type=int, default=3,
+                              help="the number of timing runs, the fastest is reported")
+    parse_parser.add_argument("--baseline", dest="baseline",
+                              metavar="<filename>", default=BASELINE_FILE,
+                              help="the saved results to compare against")
+    parse_parser.add_argument("--save-baseline", dest="save_baseline",
+                              help="save the results as the new baseline",
+                              action="store_true")
+    parse_parser.add_argument("--tolerance", dest="tolerance",
+                              metavar="<percent>", type=float, default=10,
+                              help="how much slower than the baseline a stage can be before the run fails")
+    parse_parser.set_defaults(func=parse)
+    main(arg_parser.parse_args())
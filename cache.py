@@ -0,0 +1,116 @@
+#!/usr/bin/env python -OO
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+import pickle
+import sqlite3
+import time
+import zlib
+
+# The default limit on the size of the cache, in megabytes
+CACHE_MB = 512
+
+# The keys looked up per query, under SQLite's limit on parameters
+FIND_CHUNK = 500
+
+# What PRAGMA auto_vacuum returns for INCREMENTAL
+INCREMENTAL = 2
+
+
+class GameCache(object):
+    """Parsed games saved by their game id and the hash of their page and of the parser.
+
+    Each entry is a game record pickled and zlib-compressed, in a SQLite
+    file. A game is only parsed again when its page or the parser changes;
+    entries for old versions of either are evicted, least recently used
+    first, once the cache is over its size limit.
+    """
+
+    def __init__(self, path, fingerprint, max_mb=CACHE_MB):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.max_bytes = max_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        folder = os.path.dirname(path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.sql = sqlite3.connect(path)
+        # Only takes effect on a new file, or after a VACUUM
+        self.sql.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+        self.sql.execute("""CREATE TABLE IF NOT EXISTS games(
+            key TEXT PRIMARY KEY,
+            game_id INTEGER,
+            record BLOB,
+            size INTEGER,
+            used INTEGER
+        )""")
+
+    def key(self, gid, page_hash):
+        """The key of a game: a copy of a page under another game id is a different game."""
+        return hashlib.sha1(("%s:%s:%s" % (gid, page_hash, self.fingerprint)).encode("utf-8")).hexdigest()
+
+    def find(self, keys):
+        """Returns the set of the keys that are in the cache, without loading their games."""
+        keys = list(keys)
+        found = set()
+        for i in range(0, len(keys), FIND_CHUNK):
+            chunk = keys[i:i + FIND_CHUNK]
+            found.update(row[0] for row in self.sql.execute(
+                "SELECT key FROM games WHERE key IN (%s);" % ", ".join("?" * len(chunk)), chunk))
+        self.misses += len(set(keys) - found)
+        return found
+
+    def get(self, key, gid):
+        """Returns the cached game gid, or None."""
+        row = self.sql.execute("SELECT record FROM games WHERE key = ? AND game_id = ?;", (key, gid, )).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.sql.execute("UPDATE games SET used = ? WHERE key = ?;", (time.time_ns(), key, ))
+        return pickle.loads(zlib.decompress(row[0]))
+
+    def put(self, key, game):
+        record = zlib.compress(pickle.dumps(game, pickle.HIGHEST_PROTOCOL))
+        self.sql.execute("INSERT OR REPLACE INTO games VALUES(?, ?, ?, ?, ?);",
+                         (key, game["game_id"], record, len(record), time.time_ns(), ))
+
+    def close(self):
+        """Evicts the least recently used games over the size limit and saves the cache.
+
+        The pages the evicted games took up are given back, so the file
+        shrinks with the cache.
+        """
+        total = self.sql.execute("SELECT coalesce(sum(size), 0) FROM games;").fetchone()[0]
+        evict = []
+        if total > self.max_bytes:
+            for key, size in self.sql.execute("SELECT key, size FROM games ORDER BY used;"):
+                if total <= self.max_bytes:
+                    break
+                evict.append((key, ))
+                total -= size
+            self.sql.executemany("DELETE FROM games WHERE key = ?;", evict)
+        self.sql.commit()
+        if evict:
+            if self.sql.execute("PRAGMA auto_vacuum;").fetchone()[0] == INCREMENTAL:
+                # execute() would only free the first page, it steps the
+                # statement once
+                self.sql.executescript("PRAGMA incremental_vacuum;")
+            else:
+                # A cache made before auto_vacuum was set, this switches it over
+                self.sql.execute("VACUUM;")
+        self.sql.close()
+
+
+def fingerprint(*sources):
+    """Returns a hash of the given source files and strings, e.g. the parser and the engine name."""
+    digest = hashlib.sha1()
+    for source in sources:
+        if os.path.isfile(source):
+            with open(source, "rb") as f:
+                digest.update(f.read())
+        else:
+            digest.update(source.encode("utf-8"))
+    return digest.hexdigest()
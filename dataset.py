@@ -0,0 +1,331 @@
+#!/usr/bin/env python -OO
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import sys
+
+import numpy
+
+from export import TABLES
+
+# The rows read from SQLite at a time
+CHUNK_SIZE = 50000
+
+
+def main(args):
+    if not os.path.exists(args.database):
+        print("The specified database does not exist.")
+        sys.exit(1)
+    dataset = load(args.database, rebuild=args.rebuild)
+    for name in sorted(dataset.tables):
+        table = dataset[name]
+        print("%-24s %10d rows %10.1f MB" % (name, len(table), table.nbytes() / 1024.0 / 1024.0))
+    print("Cached in", cache_path(args.database))
+
+
+def load(database, cache=True, rebuild=False):
+    """Loads the database into a Dataset.
+
+    The first load of a database saves the columns as .npy files next to it;
+    later loads memory-map them, so only the parts that are used get read.
+    The cache is rebuilt when the database changes.
+    """
+    path = cache_path(database)
+    if cache and not rebuild and cache_valid(database, path):
+        return Dataset.open(path)
+    dataset = Dataset.read(database)
+    if cache:
+        dataset.save(path, database_state(database))
+        return Dataset.open(path)
+    return dataset
+
+
+def cache_path(database):
+    return os.path.splitext(database)[0] + ".dataset"
+
+
+def database_state(database):
+    stat = os.stat(database)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def cache_valid(database, path):
+    try:
+        with open(os.path.join(path, "meta.json")) as f:
+            return json.load(f)["database"] == database_state(database)
+    except (IOError, ValueError, KeyError):
+        return False
+
+
+class TextColumn(object):
+    """A dictionary-encoded text column.
+
+    codes holds an index into the dictionary for every row, -1 for NULL. The
+    dictionary itself is the UTF-8 of every distinct value laid end to end in
+    data, with value i at data[offsets[i]:offsets[i + 1]], so it can be
+    memory-mapped like the numeric columns.
+    """
+
+    def __init__(self, codes, offsets, data):
+        self.codes = codes
+        self.offsets = offsets
+        self.data = data
+        self._index = None
+
+    @classmethod
+    def encode(cls, values):
+        index = {}
+        codes = numpy.empty(len(values), dtype=numpy.int32)
+        for i, value in enumerate(values):
+            codes[i] = -1 if value is None else index.setdefault(value, len(index))
+        encoded = [value.encode("utf-8") for value in index]
+        offsets = numpy.zeros(len(encoded) + 1, dtype=numpy.int64)
+        numpy.cumsum([len(value) for value in encoded], out=offsets[1:])
+        data = numpy.frombuffer(b"".join(encoded), dtype=numpy.uint8)
+        return cls(codes, offsets, data)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        return self.value(self.codes[i])
+
+    def value(self, code):
+        """Returns the text a code stands for."""
+        if code < 0:
+            return None
+        return self.data[self.offsets[code]:self.offsets[code + 1]].tobytes().decode("utf-8")
+
+    def code(self, value):
+        """Returns the code of a value, -2 (matching no rows) if it's not in the column."""
+        if self._index is None:
+            self._index = dict((self.value(code), code) for code in range(len(self.offsets) - 1))
+        return -1 if value is None else self._index.get(value, -2)
+
+    def values(self):
+        return [self.value(code) for code in self.codes]
+
+    def take(self, rows):
+        """Returns the column for the given rows, sharing the dictionary."""
+        return TextColumn(self.codes[rows], self.offsets, self.data)
+
+    def nbytes(self):
+        return self.codes.nbytes + self.offsets.nbytes + self.data.nbytes
+
+
+class Table(object):
+    """The columns of one table: NumPy arrays and TextColumns by name.
+
+    Numeric columns with NULLs in them are masked arrays.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def nbytes(self):
+        total = 0
+        for column in self.columns.values():
+            total += column.nbytes() if isinstance(column, TextColumn) else column.nbytes
+            if numpy.ma.isMaskedArray(column):
+                total += column.mask.nbytes
+        return total
+
+    def keys(self, name):
+        """Returns a column as something == and numpy.isin work on: the codes of text columns."""
+        column = self.columns[name]
+        return column.codes if isinstance(column, TextColumn) else column
+
+    def mask(self, **conditions):
+        """Returns the rows where every column equals its value (or is in it, for lists).
+
+        e.g. table.mask(round=2, is_daily_double=1)
+        """
+        selected = numpy.ones(len(self), dtype=bool)
+        for name, value in conditions.items():
+            column = self.columns[name]
+            if isinstance(column, TextColumn):
+                value = [column.code(v) for v in value] if isinstance(value, (list, tuple, set)) else column.code(value)
+            keys = self.keys(name)
+            matches = numpy.isin(keys, list(value)) if isinstance(value, (list, tuple, set)) else keys == value
+            selected &= numpy.ma.filled(matches, False)
+        return selected
+
+    def filter(self, mask=None, **conditions):
+        """Returns the rows of the table where the mask is true and the conditions hold."""
+        if conditions:
+            mask = self.mask(**conditions) if mask is None else mask & self.mask(**conditions)
+        rows = numpy.flatnonzero(mask)
+        return Table(dict((name, column.take(rows) if isinstance(column, TextColumn) else column[rows])
+                          for name, column in self.columns.items()))
+
+    def group_by(self, keys, column=None, how="count"):
+        """Groups the rows by the key columns and aggregates a column.
+
+        how is count, sum or mean (of column, ignoring its NULLs). Rows with
+        a NULL key are left out. Returns a Table of the keys and the result,
+        one row per group, in key order.
+        """
+        if isinstance(keys, str):
+            keys = [keys]
+        key_arrays = [self.keys(name) for name in keys]
+        valid = numpy.ones(len(self), dtype=bool)
+        for name, array in zip(keys, key_arrays):
+            if isinstance(self.columns[name], TextColumn):
+                valid &= array >= 0
+            else:
+                valid &= ~numpy.ma.getmaskarray(array)
+        stacked = numpy.stack([numpy.ma.getdata(array)[valid] for array in key_arrays], axis=1)
+        groups, inverse = numpy.unique(stacked, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+
+        if how == "count":
+            result = numpy.bincount(inverse, minlength=len(groups))
+        elif how in ("sum", "mean"):
+            values = self.columns[column][valid]
+            present = ~numpy.ma.getmaskarray(values)
+            data = numpy.ma.getdata(values).astype(numpy.float64)
+            result = numpy.bincount(inverse, weights=numpy.where(present, data, 0), minlength=len(groups))
+            if how == "mean":
+                counts = numpy.bincount(inverse, weights=present, minlength=len(groups))
+                with numpy.errstate(invalid="ignore", divide="ignore"):
+                    result = result / counts
+        else:
+            raise ValueError("can't aggregate with %r, only count, sum or mean" % how)
+
+        columns = {}
+        for i, name in enumerate(keys):
+            original = self.columns[name]
+            if isinstance(original, TextColumn):
+                columns[name] = TextColumn(groups[:, i].astype(numpy.int32), original.offsets, original.data)
+            else:
+                columns[name] = groups[:, i]
+        columns[how if column is None else "%s_%s" % (how, column)] = result
+        return Table(columns)
+
+
+class Dataset(object):
+    """Every table of the parser's database, column by column."""
+
+    def __init__(self, tables):
+        self.tables = tables
+
+    def __getitem__(self, name):
+        return self.tables[name]
+
+    @classmethod
+    def read(cls, database):
+        """Reads the tables from the SQLite database."""
+        sql = sqlite3.connect("file:%s?mode=ro" % database, uri=True)
+        try:
+            return cls(dict((table, read_table(sql, table)) for table in TABLES))
+        finally:
+            sql.close()
+
+    def save(self, path, state):
+        """Saves every column as .npy files in the folder at path."""
+        building = path + ".building"
+        shutil.rmtree(building, ignore_errors=True)
+        os.makedirs(building)
+        meta = {"database": state, "tables": {}}
+        for name, table in self.tables.items():
+            columns = meta["tables"][name] = []
+            for column_name, column in table.columns.items():
+                prefix = os.path.join(building, "%s.%s" % (name, column_name))
+                if isinstance(column, TextColumn):
+                    columns.append([column_name, "text"])
+                    numpy.save(prefix + ".codes.npy", column.codes)
+                    numpy.save(prefix + ".offsets.npy", column.offsets)
+                    numpy.save(prefix + ".data.npy", column.data)
+                else:
+                    columns.append([column_name, "numeric"])
+                    numpy.save(prefix + ".npy", numpy.ma.getdata(column))
+                    if numpy.ma.isMaskedArray(column):
+                        numpy.save(prefix + ".mask.npy", numpy.ma.getmaskarray(column))
+        with open(os.path.join(building, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=1, sort_keys=True)
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(building, path)
+
+    @classmethod
+    def open(cls, path):
+        """Memory-maps a saved dataset."""
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        tables = {}
+        for name, columns in meta["tables"].items():
+            table = {}
+            for column_name, kind in columns:
+                prefix = os.path.join(path, "%s.%s" % (name, column_name))
+                if kind == "text":
+                    table[column_name] = TextColumn(*[numpy.load(prefix + suffix, mmap_mode="r")
+                                                      for suffix in (".codes.npy", ".offsets.npy", ".data.npy")])
+                else:
+                    data = numpy.load(prefix + ".npy", mmap_mode="r")
+                    if os.path.exists(prefix + ".mask.npy"):
+                        data = numpy.ma.MaskedArray(data, mask=numpy.load(prefix + ".mask.npy", mmap_mode="r"))
+                    table[column_name] = data
+            tables[name] = Table(table)
+        return cls(tables)
+
+
+def read_table(sql, table):
+    """Reads a table into columns, typed by the columns' declared SQLite types."""
+    declared = [(column[1], column[2].upper()) for column in sql.execute("PRAGMA table_info(%s);" % table)]
+    values = [[] for _ in declared]
+    cursor = sql.execute("SELECT %s FROM %s;" % (", ".join('"%s"' % name for name, _ in declared), table))
+    for chunk in iter(lambda: cursor.fetchmany(CHUNK_SIZE), []):
+        for i, column in enumerate(zip(*chunk)):
+            values[i].extend(column)
+    columns = {}
+    for (name, kind), column in zip(declared, values):
+        if kind in ("INTEGER", "REAL") and all(value is None or isinstance(value, (int, float)) for value in column):
+            columns[name] = numeric_column(column, kind)
+        else:
+            # Including the numeric columns some odd page left text in
+            columns[name] = TextColumn.encode([value if value is None else str(value) for value in column])
+    return Table(columns)
+
+
+def numeric_column(values, kind):
+    """Returns the values as the smallest array type that holds them, masked where NULL."""
+    nulls = numpy.fromiter((value is None for value in values), dtype=bool, count=len(values))
+    filled = [0 if value is None else value for value in values]
+    if kind == "REAL":
+        array = numpy.array(filled, dtype=numpy.float64)
+    else:
+        array = numpy.array(filled, dtype=numpy.int64)
+        if len(array):
+            for dtype in (numpy.int8, numpy.int16, numpy.int32):
+                info = numpy.iinfo(dtype)
+                if info.min <= array.min() and array.max() <= info.max:
+                    array = array.astype(dtype)
+                    break
+    if nulls.any():
+        return numpy.ma.MaskedArray(array, mask=nulls)
+    return array
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Load the J! Archive database into NumPy columns and cache them for analysis.")
+    parser.add_argument("-f", "--filename", dest="database",
+                        metavar="<filename>",
+                        help="the SQLite database to load",
+                        default="output/database.db")
+    parser.add_argument("--rebuild",
+                        help="rebuild the cache even if the database hasn't changed",
+                        action="store_true")
+    main(parser.parse_args())
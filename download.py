@@ -1,102 +1,325 @@
 #!/usr/bin/env python -OO
 # -*- coding: utf-8 -*-
 
+from urllib.request import Request
 from urllib.request import urlopen
 from urllib.error import HTTPError
+from urllib.error import URLError
 
+import archive
+import argparse
+import asyncio
+import json
 import os
+import random
+import sqlite3
 import time
-import concurrent.futures as futures
 
 current_working_directory = os.path.dirname(os.path.abspath(__file__))
 archive_folder = os.path.join(current_working_directory, "j-archive")
+GAME_URL = "http://j-archive.com/showgame.php?game_id=%s"
 SECONDS_BETWEEN_REQUESTS = 5
 ERROR_MSG = "ERROR: No game"
+# Responses worth trying again, everything else is given up on right away
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RETRIES = 4
+BACKOFF_SECONDS = 2
+TIMEOUT_SECONDS = 60
+# The highest game ids, which are refetched on every run since J! Archive
+# fills in recent games over time
+RECENT_GAMES = 50
+# How many ids in a row have to be missing to be past the end of the archive
+GAP_PROBES = 3
 NUM_THREADS = 2  # Be conservative
 try:
     import multiprocessing
     # Since it's a lot of IO let's double # of actual cores
     NUM_THREADS = multiprocessing.cpu_count() * 2
-    print('Using {} threads'.format(NUM_THREADS))
 except (ImportError, NotImplementedError):
     pass
 
 
-def main():
-    create_archive_dir()
+def main(args):
+    store = archive.open_store(args.dir)
+    store.create()
     print("Downloading game files")
-    download_pages()
-
-
-def create_archive_dir():
-    if not os.path.isdir(archive_folder):
-        print("Making %s" % archive_folder)
-        os.mkdir(archive_folder)
-
-def download_pages_on_single_thread():
-    page = 1
-    while True:
-        f = download_and_save_page(page)
-        page += 1
-        # Block and stop if we're done downloading the page
-        if not f:
-            break
-
-def download_pages():
-    page = 1
-    with futures.ThreadPoolExecutor(max_workers=NUM_THREADS) as executor:
-        # We submit NUM_THREADS tasks at a time since we don't know how many
-        # pages we will need to download in advance
+    print("Using {} connections".format(args.concurrency))
+    downloader = Downloader(store, args.url, args.concurrency, args.rate,
+                            args.retries, args.refresh, args.recent)
+    asyncio.run(downloader.run(args.database))
+
+
+class TokenBucket(object):
+    """Hands out `rate` tokens a second, saving up at most `capacity`."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        """Waits until a token is available and takes it."""
         while True:
-            l = []
-            for i in range(NUM_THREADS):
-                f = executor.submit(download_and_save_page, page)
-                l.append(f)
-                page += 1
-            # Block and stop if we're done downloading the page
-            if not all(f.result() for f in l):
-                break
-
-
-def download_and_save_page(page):
-    new_file_name = "%s.html" % page
-    destination_file_path = os.path.join(archive_folder, new_file_name)
-    if not os.path.exists(destination_file_path):
-        html = download_page(page)
-        if ERROR_MSG in html:
-            # Now we stop
-            print("Finished downloading. Now parse.")
-            return False
-        elif html:
-            save_file(html, destination_file_path)
-            time.sleep(SECONDS_BETWEEN_REQUESTS)  # Remember to be kind to the server
-    else:
-        print("Already downloaded %s" % destination_file_path)
-    return True
-
-
-def download_page(page):
-    url = 'http://j-archive.com/showgame.php?game_id=%s' % page
-    html = None
-    try:
-        response = urlopen(url)
-        if response.code == 200:
-            print("Downloading %s" % url)
-            html = response.read().decode(response.headers.get_content_charset())
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Downloader(object):
+    """Downloads the game pages with a bounded number of requests in flight.
+
+    All the requests share one token bucket, so the server never sees more
+    than `rate` requests a second no matter how many are in flight.
+
+    The manifest keeps the state of every game id seen so far:
+
+    complete  downloaded, and parsed in full if it's been parsed
+    partial   downloaded, but games.game_data_complete = 0 in the database
+    missing   J! Archive has no game with this id (yet)
+    error     the last request for it failed
+
+    Only the ids that aren't known yet, partial and error ones, and the
+    `recent` highest ids (which J! Archive is still filling in) are fetched.
+    """
+
+    def __init__(self, store, url=GAME_URL, concurrency=NUM_THREADS,
+                 rate=float(NUM_THREADS) / SECONDS_BETWEEN_REQUESTS,
+                 retries=RETRIES, refresh=False, recent=RECENT_GAMES):
+        self.store = store
+        self.url = url
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate)
+        self.retries = retries
+        self.refresh = refresh
+        self.recent = recent
+        self.manifest = load_manifest(store.manifest_path)
+        # The ids requested while looking for the end of the archive
+        self.probed = set()
+
+    async def run(self, database=None):
+        """Finds the end of the archive and downloads what the plan calls for."""
+        try:
+            self.sync_states(database)
+            end = await self.find_end()
+            pages = self.plan(end)
+            print("Downloading {} of {} game ids".format(len(pages), end - 1))
+            await self.download_pages(pages)
+        finally:
+            save_manifest(self.store.manifest_path, self.manifest)
+        print("Finished downloading. Now parse.")
+
+    def state(self, page):
+        return self.manifest.get(str(page), {}).get("state")
+
+    def set_state(self, page, state):
+        self.manifest.setdefault(str(page), {})["state"] = state
+
+    def sync_states(self, database=None):
+        """Brings the states of the downloaded games up to date.
+
+        Files downloaded before there was a manifest count as complete, and
+        the games the database has incomplete data for become partial.
+        """
+        for page in self.store.ids():
+            if self.state(page) in (None, "missing", "error"):
+                self.set_state(page, "complete")
+        if not database or not os.path.exists(database):
+            return
+        with sqlite3.connect(database) as sql:
+            for page, game_data_complete in sql.execute("SELECT game_id, game_data_complete FROM games;"):
+                if self.state(page) in ("complete", "partial"):
+                    self.set_state(page, "complete" if game_data_complete else "partial")
+
+    def downloaded(self, page):
+        return self.state(page) in ("complete", "partial")
+
+    async def find_end(self):
+        """Returns the first game id past the end of the archive.
+
+        Steps up from the highest downloaded id in growing strides until it
+        passes the end, then binary searches the last stride. There are gaps
+        in the game ids, so an id only counts as past the end when the next
+        GAP_PROBES - 1 ids are missing too.
+        """
+        downloaded = [int(page) for page in self.manifest if self.downloaded(page)]
+        last = max(downloaded) if downloaded else 0
+        stride = 1
+        while await self.exists_near(last + stride):
+            last += stride
+            stride *= 2
+        end = last + stride
+        while end - last > 1:
+            middle = (last + end) // 2
+            if await self.exists_near(middle):
+                last = middle
+            else:
+                end = middle
+        return end
+
+    async def exists_near(self, page):
+        """Whether there's a game at any of the GAP_PROBES ids from page."""
+        for probe in range(page, page + GAP_PROBES):
+            if not self.downloaded(probe) and probe not in self.probed:
+                self.probed.add(probe)
+                await self.download_and_save_page(probe)
+            if self.downloaded(probe):
+                return True
+        return False
+
+    def plan(self, end):
+        """Returns the game ids below end that need to be (re)downloaded."""
+        pages = []
+        for page in range(1, end):
+            state = self.state(page)
+            if page in self.probed:
+                # Fetched while looking for the end
+                continue
+            if self.refresh or state in (None, "partial", "error") or page >= end - self.recent:
+                pages.append(page)
+        return pages
+
+    async def download_pages(self, pages):
+        """Downloads the given pages, keeping `concurrency` requests in flight."""
+        pending = set()
+        for page in pages:
+            if len(pending) >= self.concurrency:
+                _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            pending.add(asyncio.ensure_future(self.download_and_save_page(page)))
+        await asyncio.gather(*pending)
+
+    async def download_and_save_page(self, page):
+        """Downloads a page, marking it as an error if that fails in a way
+        the retries don't cover, e.g. a page that won't decode or a failed
+        write, so one page doesn't stop the run."""
+        try:
+            await self.save_page(page)
+        except Exception as e:
+            print("failed to download %s (%s: %s)" % (self.url % page, type(e).__name__, e))
+            self.set_state(page, "error")
+
+    async def save_page(self, page):
+        """Downloads a page, revalidating it if it's been downloaded already."""
+        headers = {}
+        entry = self.manifest.get(str(page), {})
+        if page in self.store:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        status, html, response_headers = await self.download_page(page, headers)
+        if status == 304:
+            print("Not modified %s" % (self.url % page))
+        elif html is None:
+            self.set_state(page, "error")
+        elif ERROR_MSG in html:
+            self.set_state(page, "missing")
         else:
-            print("Invalid URL: %s" % url)
-    except HTTPError:
+            self.store.write(page, html)
+            self.manifest[str(page)] = {
+                # Still partial until the database says otherwise
+                "state": "partial" if entry.get("state") == "partial" else "complete",
+                "etag": response_headers.get("ETag"),
+                "last_modified": response_headers.get("Last-Modified"),
+            }
+
+    async def download_page(self, page, headers):
+        """Requests a page, retrying failures that may be temporary.
+
+        Returns the (status, html, headers) of the response, with html None
+        when the page could not be downloaded.
+        """
+        url = self.url % page
+        for attempt in range(self.retries + 1):
+            await self.bucket.acquire()
+            retry_after = None
+            try:
+                response = await asyncio.to_thread(fetch, url, headers)
+                if response[0] == 200:
+                    print("Downloading %s" % url)
+                return response
+            except HTTPError as e:
+                if e.code not in RETRY_STATUSES:
+                    print("failed to open %s (%s)" % (url, e.code))
+                    return e.code, None, e.headers
+                retry_after = e.headers.get("Retry-After")
+            except (URLError, OSError):
+                pass
+            if attempt < self.retries:
+                delay = BACKOFF_SECONDS * 2 ** attempt
+                if retry_after and retry_after.isdigit():
+                    delay = max(delay, int(retry_after))
+                # Jitter so the retries of a bad patch don't all line up
+                await asyncio.sleep(delay * random.uniform(1, 1.5))
         print("failed to open %s" % url)
-    return html
+        return None, None, {}
+
+
+def fetch(url, headers):
+    """Requests the url, blocking; returns the (status, html, headers).
+
+    A 304 Not Modified response is returned with html None rather than
+    raised like the other non-2xx statuses.
+    """
+    try:
+        with urlopen(Request(url, headers=headers), timeout=TIMEOUT_SECONDS) as response:
+            html = response.read().decode(response.headers.get_content_charset() or "utf-8")
+            return response.status, html, response.headers
+    except HTTPError as e:
+        if e.code == 304:
+            return 304, None, e.headers
+        raise
+
+
+def load_manifest(path):
+    """Loads the saved states and response validators of the games."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
 
 
-def save_file(html, filename):
+def save_manifest(path, manifest):
     try:
-        with open(filename, 'w') as f:
-            f.write(html)
+        with open(path, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
     except IOError:
-        print("Couldn't write to file %s" % filename)
+        print("Couldn't write to file %s" % path)
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(
+        description="Download games from the J! Archive website.")
+    parser.add_argument("-d", "--dir", dest="dir", metavar="<folder>",
+                        help="the directory to save the game files in, or a .db page store",
+                        default=archive_folder)
+    parser.add_argument("--url", dest="url", metavar="<url>",
+                        help="the game page URL, with %%s for the game id",
+                        default=GAME_URL)
+    parser.add_argument("-c", "--concurrency", dest="concurrency",
+                        metavar="<number>", type=int, default=NUM_THREADS,
+                        help="the most requests in flight at once")
+    parser.add_argument("-r", "--rate", dest="rate", metavar="<number>",
+                        type=float,
+                        default=float(NUM_THREADS) / SECONDS_BETWEEN_REQUESTS,
+                        help="the most requests started per second")
+    parser.add_argument("--retries", dest="retries", metavar="<number>",
+                        type=int, default=RETRIES,
+                        help="how many times a failed request is retried")
+    parser.add_argument("-f", "--filename", dest="database",
+                        metavar="<filename>",
+                        help="the SQLite database the games were parsed into, to find the partial ones",
+                        default=os.path.join(current_working_directory, "output", "database.db"))
+    parser.add_argument("--recent", dest="recent", metavar="<number>",
+                        type=int, default=RECENT_GAMES,
+                        help="how many of the highest game ids to check for changes")
+    parser.add_argument("--refresh",
+                        help="check all the downloaded games for changes",
+                        action="store_true")
+    main(parser.parse_args())
@@ -0,0 +1,191 @@
+#!/usr/bin/env python -OO
+# -*- coding: utf-8 -*-
+
+import argparse
+import bz2
+import csv
+import gzip
+import lzma
+import multiprocessing
+import os
+import sqlite3
+import sys
+
+TABLES = [
+    "categories",
+    "clue_wrong_answers",
+    "clues",
+    "final_jeopardy_answers",
+    "game_players",
+    "games",
+    "players",
+]
+
+# Denormalized exports, one row per clue with what it takes to read it on its own
+VIEWS = {
+    "clues_full": """SELECT clues.clue_id, clues.game_id, air_number, air_date,
+        round, column, row, value, is_daily_double, category, order_number,
+        clue, answer, answer_player_id, players.name AS answer_player_name
+    FROM clues
+    JOIN games ON clues.game_id = games.game_id
+    LEFT JOIN categories ON clues.category_id = categories.category_id
+    LEFT JOIN players ON clues.answer_player_id = players.player_id
+    ORDER BY clues.clue_id""",
+}
+
+CSV_COMPRESSION = {
+    "gzip": (gzip.open, ".gz"),
+    "bz2": (bz2.open, ".bz2"),
+    "xz": (lzma.open, ".xz"),
+}
+
+CHUNK_SIZE = 10000
+
+# The SQLite storage classes the values of a numeric column can have
+NUMERIC_STORAGE = {
+    "INTEGER": ["null", "integer"],
+    "REAL": ["null", "integer", "real"],
+}
+
+
+def main(args):
+    if not os.path.exists(args.database):
+        print("The specified database does not exist.")
+        sys.exit(1)
+    if args.format == "csv" and args.compression not in (None, *CSV_COMPRESSION):
+        print("CSV files can be compressed with %s." % ", ".join(sorted(CSV_COMPRESSION)))
+        sys.exit(1)
+    if not os.path.isdir(args.output):
+        os.makedirs(args.output)
+
+    queries = [(table, "SELECT * FROM %s" % table) for table in args.tables or TABLES]
+    if args.views:
+        queries.extend(sorted(VIEWS.items()))
+    exports = [(args.database, name, query, args.output, args.format,
+                args.compression, args.chunk_size) for name, query in queries]
+    for filename, rows in export_all(exports, args.jobs):
+        print("exported %d rows to %s" % (rows, filename))
+
+
+def export_all(exports, jobs=1):
+    """Runs the exports, yielding each one's result as it finishes."""
+    if jobs <= 1:
+        for result in map(export, exports):
+            yield result
+        return
+    with multiprocessing.Pool(jobs) as pool:
+        for result in pool.imap_unordered(export, exports):
+            yield result
+
+
+def export(task):
+    """Exports the rows of a query, reading and writing chunk_size rows at a time.
+
+    Each export has its own read-only connection, so they can run in
+    parallel. Returns the (filename, number of rows) exported.
+    """
+    database, name, query, folder, fmt, compression, chunk_size = task
+    sql = sqlite3.connect("file:%s?mode=ro" % database, uri=True)
+    try:
+        cursor = sql.execute(query)
+        chunks = iter(lambda: cursor.fetchmany(chunk_size), [])
+        filename = os.path.join(folder, name)
+        if fmt == "parquet":
+            filename += ".parquet"
+            rows = write_parquet(filename, chunks, column_types(sql, query), compression)
+        else:
+            filename += ".csv"
+            rows = write_csv(filename, chunks, [column[0] for column in cursor.description], compression)
+    finally:
+        sql.close()
+    return filename, rows
+
+
+def write_csv(filename, chunks, columns, compression=None):
+    """Writes the chunks of rows to a CSV file, compressed if asked to."""
+    opener, extension = CSV_COMPRESSION.get(compression, (open, ""))
+    rows = 0
+    with opener(filename + extension, "wt", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for chunk in chunks:
+            writer.writerows(chunk)
+            rows += len(chunk)
+    return rows
+
+
+def write_parquet(filename, chunks, columns, compression=None):
+    """Writes the chunks of rows to a Parquet file, a row group per chunk."""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        print("Parquet output needs pyarrow (pip install pyarrow).")
+        sys.exit(1)
+    types = {"INTEGER": pyarrow.int64(), "REAL": pyarrow.float64()}
+    schema = pyarrow.schema([(name, types.get(declared, pyarrow.string())) for name, declared in columns])
+    # Only TEXT columns are sure to hold nothing but text
+    as_text = [declared not in types and declared != "TEXT" for _, declared in columns]
+    rows = 0
+    with pyarrow.parquet.ParquetWriter(filename, schema, compression=compression or "snappy") as writer:
+        for chunk in chunks:
+            arrays = []
+            for column, field, text in zip(zip(*chunk), schema, as_text):
+                if text:
+                    column = [value if value is None else str(value) for value in column]
+                arrays.append(pyarrow.array(column, type=field.type))
+            writer.write_batch(pyarrow.RecordBatch.from_arrays(arrays, schema=schema))
+            rows += len(chunk)
+    return rows
+
+
+def column_types(sql, query):
+    """Returns the (name, declared type) of each column the query returns.
+
+    A numeric column some odd page left text in has no declared type
+    instead, so it's exported as text, as dataset.py reads it.
+    """
+    sql.execute("CREATE TEMP VIEW export_columns AS %s" % query)
+    try:
+        columns = [(column[1], column[2].upper()) for column in sql.execute("PRAGMA temp.table_info(export_columns);")]
+        numeric = [(name, declared) for name, declared in columns if declared in NUMERIC_STORAGE]
+        if not numeric:
+            return columns
+        # One pass over the rows for all the numeric columns
+        mixed = sql.execute("SELECT %s FROM temp.export_columns;" % ", ".join(
+            "coalesce(max(typeof(\"%s\") NOT IN (%s)), 0)" % (name, ", ".join("'%s'" % storage for storage in NUMERIC_STORAGE[declared]))
+            for name, declared in numeric)).fetchone()
+        mixed = set(name for (name, _), is_mixed in zip(numeric, mixed) if is_mixed)
+        return [(name, "" if name in mixed else declared) for name, declared in columns]
+    finally:
+        sql.execute("DROP VIEW temp.export_columns")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export the tables of the J! Archive database to CSV or Parquet files.")
+    parser.add_argument("-f", "--filename", dest="database",
+                        metavar="<filename>",
+                        help="the SQLite database to export",
+                        default="output/database.db")
+    parser.add_argument("-o", "--output", dest="output", metavar="<folder>",
+                        help="the directory to write the files to",
+                        default="output")
+    parser.add_argument("-t", "--table", dest="tables", metavar="<table>",
+                        choices=TABLES, action="append",
+                        help="a table to export, all of them by default")
+    parser.add_argument("--format", dest="format", choices=["csv", "parquet"],
+                        help="the file format to write",
+                        default="csv")
+    parser.add_argument("-z", "--compression", dest="compression",
+                        metavar="<codec>",
+                        help="compress the files: gzip, bz2 or xz for CSV, any codec pyarrow supports for Parquet")
+    parser.add_argument("-c", "--chunk-size", dest="chunk_size",
+                        metavar="<number>", type=int, default=CHUNK_SIZE,
+                        help="the number of rows read and written at a time")
+    parser.add_argument("-j", "--jobs", dest="jobs", metavar="<number>",
+                        help="the number of tables exported at once",
+                        type=int, default=1)
+    parser.add_argument("--views",
+                        help="also export the denormalized views: %s" % ", ".join(sorted(VIEWS)),
+                        action="store_true")
+    main(parser.parse_args())
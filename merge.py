@@ -0,0 +1,98 @@
+#!/usr/bin/env python -OO
+# -*- coding: utf-8 -*-
+
+import analytics
+import argparse
+import os
+import parser
+import search
+import sqlite3
+import sys
+import time
+
+# The tables copied from every shard as they are
+COPIED = ["games", "game_players", "clues", "clue_wrong_answers", "final_jeopardy_answers", "game_files", "quarantine", "shards"]
+
+# A player's name and details are the first ones seen, their nickname the
+# last one seen, as when the games are parsed into one database
+MERGE_PLAYERS = """INSERT INTO players SELECT * FROM shard.players WHERE true
+ON CONFLICT(player_id) DO UPDATE SET nickname = coalesce(excluded.nickname, players.nickname);"""
+
+
+def main(args):
+    for path in args.shards:
+        if not os.path.exists(path):
+            print("The shard %s does not exist." % path)
+            sys.exit(1)
+    start = time.perf_counter()
+    sql = sqlite3.connect(args.database)
+    try:
+        parser.create_schema(sql)
+        sql.execute(parser.CREATE_SHARDS)
+        if sql.execute("SELECT count(*) FROM games;").fetchone()[0] and not sql.execute("SELECT count(*) FROM shards;").fetchone()[0]:
+            print("%s wasn't built from shards, its ids would collide with theirs." % args.database)
+            sys.exit(1)
+        for path in sorted(args.shards, key=first_game):
+            print("Merging", path)
+            merge(sql, path)
+        for index in parser.INDEXES:
+            sql.execute(index)
+        if args.search:
+            search.rebuild(sql)
+        if args.analytics:
+            analytics.build(sql)
+        sql.commit()
+    finally:
+        sql.close()
+    print("Merged %d shards in %.1fs" % (len(args.shards), time.perf_counter() - start))
+
+
+def first_game(path):
+    """The shards are merged in game id order, so the players' nicknames come out the same."""
+    with sqlite3.connect("file:%s?mode=ro" % path, uri=True) as sql:
+        first = sql.execute("SELECT min(game_id) FROM games;").fetchone()[0]
+    return (first is None, first)
+
+
+def merge(sql, path):
+    """Copies a shard into the database, in one transaction."""
+    sql.execute("ATTACH DATABASE ? AS shard;", (path, ))
+    try:
+        if not sql.execute("SELECT count(*) FROM shard.sqlite_master WHERE name = 'shards';").fetchone()[0]:
+            print("%s isn't a shard, build it with --shard-games or --shard-dates." % path)
+            sys.exit(1)
+        overlap = sql.execute("SELECT count(*) FROM shard.games WHERE game_id IN (SELECT game_id FROM main.games);").fetchone()[0]
+        if overlap:
+            print("%s has %d games that are already merged." % (path, overlap))
+            sys.exit(1)
+        collisions = sql.execute("""SELECT count(*) FROM shard.categories
+            JOIN main.categories ON shard.categories.category_id = main.categories.category_id
+            WHERE shard.categories.category != main.categories.category;""").fetchone()[0]
+        if collisions:
+            print("%s has %d category ids that collide with other categories'." % (path, collisions))
+            sys.exit(1)
+        with sql:
+            sql.execute("INSERT OR IGNORE INTO categories SELECT * FROM shard.categories;")
+            sql.execute(MERGE_PLAYERS)
+            for table in COPIED:
+                sql.execute("INSERT INTO main.%s SELECT * FROM shard.%s;" % (table, table))
+    finally:
+        sql.execute("DETACH DATABASE shard;")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description="Merge shard databases built with parser.py --shard-games or --shard-dates into one.")
+    arg_parser.add_argument("shards", nargs="+", metavar="<shard>",
+                            help="the shard databases")
+    arg_parser.add_argument("-f", "--filename", dest="database",
+                            metavar="<filename>",
+                            help="the SQLite database they're merged into, created if it doesn't exist",
+                            default="output/database.db")
+    arg_parser.add_argument("-s", "--search",
+                            help="build the full-text search index of the merged clues, see search.py",
+                            action="store_true")
+    arg_parser.add_argument("-a", "--analytics",
+                            help="index the merged database for analysis and build its summary tables, see analytics.py",
+                            action="store_true")
+    main(arg_parser.parse_args())
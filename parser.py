@@ -2,119 +2,433 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import with_statement
-from bs4 import BeautifulSoup
-from glob import glob
 from urllib.parse import urlparse
 from urllib.parse import parse_qs
-from scipy.stats import rankdata
 
+import archive
+import analytics
 import argparse
+import bisect
+import hashlib
+import heapq
+import io
+import json
 import os
-import regex
+import search
 import sqlite3
 import sys
+import time
 
-def main(args): 
+# Every pattern the parser uses. The score_/clue_ class ones are matched
+# against class names by BeautifulSoup.
+PATTERN_SOURCES = {
+    "contestant": r"^,(?: an?)? (.*?) (?:(originally) from|from) (.*?)(?: \(.*\))?$",
+    "scores_first_break": "Scores at the first commercial break*.",
+    "scores_jeopardy": "Scores at the end of the Jeopardy! Round:",
+    "scores_double_jeopardy": "Scores at the end of the Double Jeopardy! Round:",
+    "scores_final": "Final scores:",
+    "score_class": "score_(positive|negative)",
+    "clue_value_class": "clue_value",
+    "clue_order_number_class": "clue_order_number",
+    "answer_table": r".*'(\(.*?)(?=\<em)",
+    "name_answer": "(.*?) ?[:;,-]+ ?(.*)",
+    "parens": "[()]",
+    "title_air_date": r"<title>[^<]*\s(\S+)\s*</title>",
+}
+
+
+class Patterns(dict):
+    """The compiled PATTERN_SOURCES, each compiled once, the first time it's used.
+
+    Like BeautifulSoup and lxml, the regex module is only imported once
+    there's something to parse, so --help and the like start right away.
+    """
+
+    def __missing__(self, name):
+        import regex
+        pattern = self[name] = regex.compile(PATTERN_SOURCES[name])
+        return pattern
+
+PATTERNS = Patterns()
+
+def main(args):
     """Loop thru all the games and parse them."""
-    if not os.path.isdir(args.dir):
-        print("The specified folder is not a directory.")
+    if args.profile:
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(load, args)
+        finally:
+            profiler.dump_stats(args.profile)
+            # Not into the games, when they're written to stdout
+            out = sys.stderr if args.sink == "jsonl" and args.database == "-" else sys.stdout
+            print("Saved the profile to", args.profile, file=out)
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(PROFILE_LINES)
+    else:
+        load(args)
+
+def load(args):
+    """Parses the games of the archive into the database, or another sink."""
+    stats = Stats(args.slowest) if args.stats else None
+    if args.stdout:
+        args.sink, args.database = "jsonl", "-"
+    if args.database is None:
+        args.database = "-" if args.sink == "jsonl" else DATABASE
+    store = archive.open_store(args.dir)
+    if not store.exists():
+        print("The specified archive does not exist.")
         sys.exit(1)
-    total_files = len(os.listdir(args.dir))
-    if args.num_of_files:
-        total_files = args.num_of_files
-    print("Parsing", total_files, "files")
+    file_numbers = store.ids()[:args.num_of_files]
+    shard = args.shard_games or args.shard_dates
+    if shard:
+        file_numbers = shard_files(store, file_numbers, args.shard_games, args.shard_dates)
+
     sql = None
-    with sqlite3.connect(args.database) as sql:
-        if not args.stdout:
-            sql.execute("""PRAGMA writable_schema = 1;""")
-            sql.execute("""DELETE FROM sqlite_master WHERE type IN ('table', 'index', 'trigger')""")
-            sql.execute("""PRAGMA writable_schema = 0;""")
-            sql.execute("""VACUUM;""")
-            sql.execute("""PRAGMA foreign_keys = ON;""")
-            sql.execute("""CREATE TABLE games(
-                game_id INTEGER PRIMARY KEY,
-                air_number INTEGER,
-                air_date TEXT,
-                game_data_complete INTEGER,
-                notes TEXT
-            );""")
-            sql.execute("""CREATE TABLE categories(
-                category_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                category TEXT UNIQUE
-            );""")
-            sql.execute("""CREATE TABLE players(
-                player_id INTEGER PRIMARY KEY,
-                name TEXT,
-                nickname TEXT,
-                occupation TEXT,
-                location TEXT,
-                is_originally INTEGER
-            );""")
-            sql.execute("""CREATE TABLE game_players(
-                game_id INTEGER,
-                player_id INTEGER,
-                place INTEGER,
-                first_break_score INTEGER,
-                first_round_score INTEGER,
-                second_round_score INTEGER,
-                final_score INTEGER,
-                coryat_score INTEGER,
-                PRIMARY KEY(game_id, player_id),
-                FOREIGN KEY(game_id) REFERENCES games(game_id),
-                FOREIGN KEY(player_id) REFERENCES players(player_id)
-            );""")
-            sql.execute("""CREATE TABLE clues(
-                clue_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                game_id INTEGER,
-                round INTEGER,
-                column INTEGER,
-                row INTEGER,
-                value INTEGER,
-                is_daily_double INTEGER,
-                category_id INTEGER,
-                order_number INTEGER,
-                clue TEXT,
-                answer TEXT,
-                answer_player_id INTEGER,
-                FOREIGN KEY(game_id) REFERENCES games(game_id),
-                FOREIGN KEY(category_id) REFERENCES categories(category_id),
-                FOREIGN KEY(answer_player_id) REFERENCES players(player_id)
-            );""")
-            sql.execute("""CREATE TABLE clue_wrong_answers(
-                clue_id INTEGER,
-                player_id INTEGER,
-                answer TEXT,
-                PRIMARY KEY(clue_id, player_id),
-                FOREIGN KEY(clue_id) REFERENCES clues(clue_id),
-                FOREIGN KEY(player_id) REFERENCES players(player_id)
-            )""")
-            sql.execute("""CREATE TABLE final_jeopardy_answers(
-                clue_id INTEGER,
-                player_id INTEGER,
-                answer TEXT,
-                wager INTEGER,
-                is_correct INTEGER,
-                PRIMARY KEY(clue_id, player_id),
-                FOREIGN KEY(clue_id) REFERENCES clues(clue_id),
-                FOREIGN KEY(player_id) REFERENCES players(player_id)
-            )""")
-            
-        file_numbers = []
-        
-        for file_name in glob(os.path.join(args.dir, "*.html")):
-            file_numbers.append(int(file_name.replace(".html", "").replace(args.dir + "\\", "")))
-            
-        for file_number in sorted(file_numbers):
-            print(file_number)
-            with open(os.path.abspath(args.dir + "\\" + str(file_number) + ".html")) as f:
-                parse_game(f, sql, file_number)
-        if not args.stdout:
-            sql.commit()
+    files = {}
+    if args.sink == "sqlite":
+        if args.retry_quarantined:
+            args.incremental = True
+        sql = open_database(args)
+        if shard:
+            record_shard(sql, args.shard_games, args.shard_dates)
+        if args.retry_quarantined:
+            quarantined = set(row[0] for row in sql.execute("SELECT game_id FROM quarantine;"))
+            file_numbers = [n for n in file_numbers if n in quarantined]
+        # Games added to a shard, or to shards merged together, get shard ids
+        # too, so more shards can still be merged in
+        if not shard and args.incremental:
+            shard = sql.execute("SELECT 1 FROM sqlite_master WHERE name = 'shards';").fetchone() is not None
+        writer = Writer(sql, args.batch_size, shard=bool(shard))
+        file_numbers = plan_files(args, store, file_numbers, sql, writer, files)
+    elif args.sink == "jsonl":
+        writer = JsonLinesSink(args.database)
+        if args.database == "-":
+            # stdout is only for the games, everything else printed goes to
+            # stderr (in the workers too, they're forked from here)
+            sys.stdout = sys.stderr
+    else:
+        writer = NullSink()
+    cache = None
+    if args.cache:
+        import cache as game_cache
+        cache = game_cache.GameCache(args.cache, game_cache.fingerprint(os.path.abspath(__file__), args.engine), args.cache_size)
+    print("Parsing", len(file_numbers), "files")
+
+    try:
+        # The workers only parse, this process is the single writer and gets
+        # the games back in game id order, so the database comes out the same
+        # no matter how many jobs are used
+        for game in parse_games(store, file_numbers, args.jobs, args.engine, cache, files):
+            print(game["game_id"])
+            # A game that can't be parsed or loaded is set aside, so one bad
+            # page doesn't stop the run
+            if "error" not in game:
+                start = time.perf_counter()
+                written = writer.write_seconds
+                try:
+                    writer.insert_game(game, files.get(game["game_id"]))
+                except Exception as e:
+                    game["stage"], game["error"] = failure(e)
+                # Less the time spent writing a batch, if this game filled one
+                insert_seconds = time.perf_counter() - start - (writer.write_seconds - written)
+            if "error" in game:
+                print("Quarantined game %s, %s failed: %s" % (game["game_id"], game["stage"], game["error"]))
+                writer.quarantine(game["game_id"], game["stage"], game["error"])
+                if stats:
+                    stats.quarantined_games += 1
+            elif stats:
+                stats.add_game(game, insert_seconds)
+        writer.flush()
+        if stats:
+            stats.write_seconds = writer.write_seconds
+        if sql is not None:
+            if stats:
+                stats.quarantined_games += writer.write_failures
+            start = time.perf_counter()
+            finish_database(args, sql)
+            if stats:
+                stats.finish_seconds = time.perf_counter() - start
+        if cache:
+            print("Replayed", cache.hits, "games from the cache and parsed", cache.misses)
+        if sql is not None:
+            quarantined = sql.execute("SELECT count(*) FROM quarantine;").fetchone()[0]
+            if quarantined:
+                print("Quarantined games: %d (see the quarantine table and --retry-quarantined)" % quarantined)
         print("All done")
+        if stats:
+            stats.report(args.stats)
+    finally:
+        writer.close()
+        if cache:
+            cache.close()
+        if sql is not None:
+            sql.close()
+        sys.stdout = sys.__stdout__
+
+def open_database(args):
+    """Connects to the database and creates the tables, emptied unless incremental."""
+    sql = sqlite3.connect(args.database)
+    if args.fast_load:
+        for pragma in FAST_LOAD_PRAGMAS:
+            sql.execute(pragma)
+    if not args.incremental:
+        sql.execute("""PRAGMA writable_schema = 1;""")
+        sql.execute("""DELETE FROM sqlite_master WHERE type IN ('table', 'index', 'trigger')""")
+        sql.execute("""PRAGMA writable_schema = 0;""")
+        # VACUUM can't run inside the transaction the DELETE opened
+        sql.commit()
+        sql.execute("""VACUUM;""")
+    sql.execute("""PRAGMA foreign_keys = ON;""")
+    create_schema(sql)
+    if args.search:
+        search.create_index(sql)
+    return sql
+
+def plan_files(args, store, file_numbers, sql, writer, files):
+    """Returns the games to parse, filling in files with their (size, mtime, hash).
+
+    In incremental mode only new and changed games are parsed; the changed
+    ones are deleted first.
+    """
+    loaded = {}
+    if args.incremental:
+        for row in sql.execute("SELECT game_id, size, mtime, hash FROM game_files;"):
+            loaded[row[0]] = row[1:]
+    for file_number in file_numbers:
+        state = store.state(file_number, loaded.get(file_number))
+        if not state:
+            continue
+        if file_number not in loaded:
+            files[file_number] = state
+        elif state[2] == loaded[file_number][2]:
+            # Touched but not changed, only the bookkeeping is updated
+            writer.record_file(file_number, state)
+        else:
+            files[file_number] = state
+            writer.delete_game(file_number)
+    if args.incremental:
+        print("Skipping", len(file_numbers) - len(files), "unchanged files")
+        return [n for n in file_numbers if n in files]
+    return file_numbers
+
+def shard_files(store, file_numbers, games=None, dates=None):
+    """Returns the games in the shard: the ids in games and the air dates in
+    dates, both (first, last) pairs. The air dates are read from the pages'
+    titles, without parsing them."""
+    if games:
+        file_numbers = [n for n in file_numbers if games[0] <= n <= games[1]]
+    if dates:
+        in_shard = []
+        for n in file_numbers:
+            m = PATTERNS["title_air_date"].search(store.read(n))
+            if m and dates[0] <= m.group(1) <= dates[1]:
+                in_shard.append(n)
+        file_numbers = in_shard
+    return file_numbers
+
+def record_shard(sql, games=None, dates=None):
+    """Marks the database as a shard, which merge.py checks for."""
+    sql.execute(CREATE_SHARDS)
+    sql.execute("DELETE FROM shards;")
+    sql.execute("INSERT INTO shards VALUES(?, ?, ?, ?);", (games or (None, None)) + (dates or (None, None)))
+    sql.commit()
+
+def shard_range(kind):
+    """An argparse type for FIRST:LAST ranges of kind (int or str)."""
+    def parse(text):
+        first, sep, last = text.partition(":")
+        if not sep:
+            raise argparse.ArgumentTypeError("%r isn't a FIRST:LAST range" % text)
+        try:
+            return (kind(first), kind(last))
+        except ValueError:
+            raise argparse.ArgumentTypeError("%r isn't a FIRST:LAST range" % text)
+    return parse
+
+def category_key(category):
+    """The category id shards use: the same for a category in every shard."""
+    return int(hashlib.sha1(category.encode("utf-8")).hexdigest()[:13], 16)
+
+def finish_database(args, sql):
+    """The post-load stages: ranking, indexes and the optional extras."""
+    import scores
+    scores.rank(sql)
+    if args.check_scores:
+        scores.check(sql)
+    for index in INDEXES:
+        sql.execute(index)
+    if args.analytics:
+        analytics.build(sql)
+    if args.fast_load:
+        sql.execute("""PRAGMA journal_mode = DELETE;""")
+    sql.commit()
+
+def create_schema(sql):
+    """Creates any of the tables that don't exist yet."""
+    sql.execute("""CREATE TABLE IF NOT EXISTS games(
+        game_id INTEGER PRIMARY KEY,
+        air_number INTEGER,
+        air_date TEXT,
+        game_data_complete INTEGER,
+        notes TEXT
+    );""")
+    sql.execute("""CREATE TABLE IF NOT EXISTS categories(
+        category_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        category TEXT UNIQUE
+    );""")
+    sql.execute("""CREATE TABLE IF NOT EXISTS players(
+        player_id INTEGER PRIMARY KEY,
+        name TEXT,
+        nickname TEXT,
+        occupation TEXT,
+        location TEXT,
+        is_originally INTEGER
+    );""")
+    sql.execute("""CREATE TABLE IF NOT EXISTS game_players(
+        game_id INTEGER,
+        player_id INTEGER,
+        place INTEGER,
+        first_break_score INTEGER,
+        first_round_score INTEGER,
+        second_round_score INTEGER,
+        final_score INTEGER,
+        coryat_score INTEGER,
+        PRIMARY KEY(game_id, player_id),
+        FOREIGN KEY(game_id) REFERENCES games(game_id),
+        FOREIGN KEY(player_id) REFERENCES players(player_id)
+    );""")
+    sql.execute("""CREATE TABLE IF NOT EXISTS clues(
+        clue_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        game_id INTEGER,
+        round INTEGER,
+        column INTEGER,
+        row INTEGER,
+        value INTEGER,
+        is_daily_double INTEGER,
+        category_id INTEGER,
+        order_number INTEGER,
+        clue TEXT,
+        answer TEXT,
+        answer_player_id INTEGER,
+        FOREIGN KEY(game_id) REFERENCES games(game_id),
+        FOREIGN KEY(category_id) REFERENCES categories(category_id),
+        FOREIGN KEY(answer_player_id) REFERENCES players(player_id)
+    );""")
+    sql.execute("""CREATE TABLE IF NOT EXISTS clue_wrong_answers(
+        clue_id INTEGER,
+        player_id INTEGER,
+        answer TEXT,
+        PRIMARY KEY(clue_id, player_id),
+        FOREIGN KEY(clue_id) REFERENCES clues(clue_id),
+        FOREIGN KEY(player_id) REFERENCES players(player_id)
+    )""")
+    sql.execute("""CREATE TABLE IF NOT EXISTS final_jeopardy_answers(
+        clue_id INTEGER,
+        player_id INTEGER,
+        answer TEXT,
+        wager INTEGER,
+        is_correct INTEGER,
+        PRIMARY KEY(clue_id, player_id),
+        FOREIGN KEY(clue_id) REFERENCES clues(clue_id),
+        FOREIGN KEY(player_id) REFERENCES players(player_id)
+    )""")
+    sql.execute("""CREATE TABLE IF NOT EXISTS game_files(
+        game_id INTEGER PRIMARY KEY,
+        size INTEGER,
+        mtime INTEGER,
+        hash TEXT
+    )""")
+    sql.execute("""CREATE TABLE IF NOT EXISTS quarantine(
+        game_id INTEGER PRIMARY KEY,
+        stage TEXT,
+        error TEXT
+    )""")
+
+
+def parse_games(store, file_numbers, jobs=1, engine="bs4", cache=None, states=None):
+    """Parses the given games of the archive, yielding them in the order given.
+
+    With a GameCache, the games whose page and parser haven't changed since
+    they were cached are replayed from it, and only the rest are parsed.
+    states can hold the games' (size, mtime, hash), so they aren't hashed
+    again.
+    """
+    if cache is None:
+        for game in parse_files(store, file_numbers, jobs, engine):
+            yield game
+        return
+    keys = {}
+    for n in file_numbers:
+        state = states.get(n) if states else None
+        keys[n] = cache.key(n, (state or store.state(n))[2])
+    # Only which games are cached is worked out up front, each one is loaded
+    # as it's yielded, so they aren't all in memory at once
+    cached = cache.find(keys.values())
+    parsed = parse_files(store, [n for n in file_numbers if keys[n] not in cached], jobs, engine)
+    for n in file_numbers:
+        if keys[n] in cached:
+            game = cache.get(keys[n], n)
+            if game is not None:
+                game["parse_seconds"] = 0
+                yield game
+                continue
+            game = parse_file((store, n, engine))
+        else:
+            game = next(parsed)
+        if "error" not in game:
+            cache.put(keys[n], game)
+        yield game
+
+def parse_files(store, file_numbers, jobs=1, engine="bs4"):
+    files = [(store, n, engine) for n in file_numbers]
+    if jobs <= 1:
+        for game in map(parse_file, files):
+            yield game
+        return
+    import multiprocessing
+    with multiprocessing.Pool(jobs) as pool:
+        # imap (unlike imap_unordered) hands the results back in order
+        for game in pool.imap(parse_file, files, chunksize=4):
+            yield game
+
+def parse_file(file):
+    """Parses a single game, given as an (archive, game id, engine) tuple.
 
-def parse_game(f, sql, gid):
-    """Parses an entire Jeopardy! game and extract individual clues."""
-    bsoup = BeautifulSoup(f, "lxml")
+    A game that fails to parse comes back as just its game id, the error and
+    the stage (the parser function) it failed in.
+    """
+    store, gid, engine = file
+    start = time.perf_counter()
+    try:
+        f = io.StringIO(store.read(gid))
+        game = ENGINES[engine](f, gid)
+    except Exception as e:
+        stage, error = failure(e)
+        return {"game_id": gid, "stage": stage, "error": error}
+    game["parse_seconds"] = time.perf_counter() - start
+    return game
+
+def failure(e):
+    """Returns the (stage, error) of an exception: the innermost parser
+    function it went through and the exception's message."""
+    import traceback
+    stage = None
+    for frame in traceback.extract_tb(e.__traceback__):
+        # Comprehensions show up as <listcomp> and the like, the function
+        # they're in is the stage
+        if os.path.basename(frame.filename) == os.path.basename(__file__) and not frame.name.startswith("<"):
+            stage = frame.name
+    return stage, traceback.format_exception_only(type(e), e)[-1].strip()
+
+def parse_game(f, gid):
+    """Parses an entire Jeopardy! game and extract individual clues.
+
+    Nothing is written here: the game is returned as a plain dict (of lists,
+    strings and numbers) so it can be sent back from a worker process and
+    handed to insert_game().
+    """
+    bsoup = read_soup(f)
 
     # The title is in the format: `J! Archive - Show #XXXX, aired 2004-09-16`,
     # where the last part is all that is required
@@ -124,22 +438,43 @@ def parse_game(f, sql, gid):
     notes = bsoup.find("div", { "id": "game_comments" }).get_text()
     notes = None if notes == "" else notes
 
-    sql.execute(
-        "INSERT OR IGNORE INTO games VALUES(?, ?, ?, ?, ?);",
-        (gid, game_number, air_date, 0, notes, )
-    )
-    player_data_complete = parse_players(bsoup, sql, gid)
-    round_data_complete = parse_round(bsoup, sql, 1, gid, game_number, air_date) and parse_round(bsoup, sql, 2, gid, game_number, air_date)
+    game = {
+        "game_id": gid,
+        "air_number": game_number,
+        "air_date": air_date,
+        "notes": notes,
+        "players": [],
+        "scores": [],
+        "clues": [],
+        "complete": False,
+        # Things worth knowing about that didn't stop the game being parsed
+        "counters": {},
+    }
+    player_data_complete = parse_players(bsoup, game)
+    round_data_complete = parse_round(bsoup, game, 1) and parse_round(bsoup, game, 2)
+    if not parse_final_round(bsoup, game):
+        # This game does not have a final clue
+        return game
+    game["complete"] = bool(player_data_complete and round_data_complete)
+    return game
+
+def read_soup(f):
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(f, "lxml")
+
+def parse_final_round(bsoup, game):
+    """Adds the Final Jeopardy! clue and answers, returning False if there are none."""
+    from bs4 import BeautifulSoup
     r = bsoup.find("table", class_="final_round")
     if not r:
-        # This game does not have a final clue
-        return
+        return False
     category = r.find("td", class_="category_name").get_text()
     text = r.find("td", class_="clue_text").get_text()
     answer = BeautifulSoup(r.find("div", onmouseover=True).get("onmouseover"), "lxml")
     answer = answer.find("em").get_text()
-    clue_id = insert(sql, [gid, air_date, 3, category, None, text, answer, game_number, None, None, 0, None, None])
-    
+    final_answers = []
+    game["clues"].append(clue_record(3, None, None, None, 0, category, None, text, answer, None, [], final_answers))
+
     final_round_answers = BeautifulSoup(r.find("div", onmouseover=True).get("onmouseover"), "lxml")
     fr_trs = final_round_answers.findAll("tr")
     
@@ -152,48 +487,22 @@ def parse_game(f, sql, gid):
         answer = first_tr_tds[1].get_text()
         wager = second_tr.find("td").get_text().replace("$", "").replace(",", "")
         is_correct = 1 if first_tr.find("td", class_="right") else 0
-        
-        p_id = sql.execute("SELECT players.player_id FROM players JOIN game_players ON players.player_id = game_players.player_id AND game_players.game_id = ? WHERE (players.nickname = ? OR players.name = ?)", (gid, name, name, )).fetchone()[0]
-        sql.execute("INSERT INTO final_jeopardy_answers(clue_id, player_id, answer, wager, is_correct) VALUES(?, ?, ?, ?, ?)", (clue_id, p_id, answer, wager, is_correct))
-    
-    if player_data_complete and round_data_complete:
-        sql.execute("UPDATE games SET game_data_complete = 1 WHERE game_id = ?", (gid,))
+        final_answers.append([name, answer, wager, is_correct])
+    return True
 
-def parse_players(bsoup, sql, gid):
-    player_ids = {}    
-    
+def parse_players(bsoup, game):
     contestants = bsoup.find_all("p", class_="contestants")
-    
-    total_players = len(contestants)
-    
-    if contestants:
-        for i in range(total_players):
-            p = contestants[i]
-            for match in p.findAll('i'):
-                match.unwrap()
 
-    contestants = bsoup.find_all("p", class_="contestants")
-    if contestants:
-        for i in range(total_players):
-            p = contestants[i]
-            name = p.find("a").get_text()
-            url = urlparse(p.find("a")["href"])
-            params = parse_qs(url.query)
-            if "player_id" in params:
-                p_id = params["player_id"][0]
-            m = regex.search("^,(?: an?)? (.*?) (?:(originally) from|from) (.*?)(?: \(.*\))?$", ''.join(p.contents[1:]))
-            occupation = m.group(1)
-            is_originally = m.group(2) != None
-            location = m.group(3)
-            player_ids[name] = p_id
-            
-            sql.execute("INSERT OR IGNORE INTO players(player_id, name, occupation, location, is_originally) VALUES(?, ?, ?, ?, ?);", (p_id, name, occupation, location, is_originally, ))
-            sql.execute("INSERT OR IGNORE INTO game_players(game_id, player_id) VALUES(?, ?)", (gid, p_id,))
-    
-    st_h3_cb = bsoup.find("h3", text=regex.compile("Scores at the first commercial break*."))
-    st_h3_j = bsoup.find("h3", text=regex.compile("Scores at the end of the Jeopardy! Round:"))
-    st_h3_dj = bsoup.find("h3", text=regex.compile("Scores at the end of the Double Jeopardy! Round:"))
-    st_h3_fs = bsoup.find("h3", text=regex.compile("Final scores:"))
+    for p in contestants:
+        for match in p.find_all('i'):
+            match.unwrap()
+
+    player_ids = parse_contestants(game, [(p.find("a").get_text(), p.find("a")["href"], ''.join(p.contents[1:])) for p in contestants])
+
+    st_h3_cb = bsoup.find("h3", text=PATTERNS["scores_first_break"])
+    st_h3_j = bsoup.find("h3", text=PATTERNS["scores_jeopardy"])
+    st_h3_dj = bsoup.find("h3", text=PATTERNS["scores_double_jeopardy"])
+    st_h3_fs = bsoup.find("h3", text=PATTERNS["scores_final"])
     
     scores_table_cb = st_h3_cb.next_sibling.next_sibling if (st_h3_cb) else None
     scores_table_j = st_h3_j.next_sibling.next_sibling if (st_h3_j) else None
@@ -203,84 +512,97 @@ def parse_players(bsoup, sql, gid):
     scores_table_cs = st_h3_cs.next_sibling.next_sibling if (st_h3_cs) else None
         
     if (scores_table_cb):
-        # Get all player nickames
-        player_nicknames = []
-        for i in range(total_players):
-            player_nicknames.append(scores_table_cb.find_all("td", class_="score_player_nickname")[i].get_text())
-    
-        # Get all player names
-        player_names = []
-        for i in range(total_players):
-            player_names.append(bsoup.find_all("p", class_="contestants")[i].find("a").get_text())
-            
-        # Try to exact match player first names to nicknames
-        player_nicknames_to_names = {}
-        for i in reversed(range(total_players)):
-            nickname = player_names[i].split()[0]
-            if nickname in player_nicknames:
-                name = player_names[i]
-                player_nicknames_to_names[nickname] = name
-                player_names.remove(name)
-                player_nicknames.remove(nickname)
-
-        # If there's only one mismatch, match it up
-        if len(player_names) == 1 and len(player_nicknames) == 1:
-            player_nicknames_to_names[player_nicknames[0]] = player_names[0]
-            player_names.remove(player_names[0])
-            player_nicknames.remove(player_nicknames[0])
-
-        # Do hacky matching to figure out remaining name/nicknames string trying to match from beginning of string
-        for i in reversed(range(len(player_names))):
-            name = player_names[i]
-            for i in range(len(name)):
-                matching_nickname = ""
-                matches_found = 0
-                for nickname in player_nicknames:
-                    if name[:i+1] == nickname[:i+1]:
-                        matching_nickname = nickname
-                        matches_found += 1
-                if matches_found == 1:
-                    player_nicknames_to_names[matching_nickname] = name
-                    player_names.remove(name)
-                    player_nicknames.remove(matching_nickname)
-                    break
-        
-        if len(player_names) > 0:
-            print("could not match all names to nicknames")
+        player_names = [p.find("a").get_text() for p in contestants]
+        player_nicknames = [td.get_text() for td in scores_table_cb.find_all("td", class_="score_player_nickname")]
+        score_tables = []
+        for table in (scores_table_cb, scores_table_j, scores_table_dj, scores_table_fs, scores_table_cs):
+            score_tables.append([td.get_text() for td in table.find_all("td", class_=PATTERNS["score_class"])] if table else None)
+        if not parse_scores(game, player_ids, player_names, player_nicknames, score_tables):
             return
+
+        return len(contestants) >= 3 and scores_table_cb and scores_table_j and scores_table_dj and scores_table_fs and scores_table_cs
+
+def parse_contestants(game, contestants):
+    """Adds the contestants to the game, returning their ids by name.
+
+    The contestants are (name, profile url, description) tuples, where the
+    description is the text after the name, e.g. ", a teacher from Austin".
+    """
+    player_ids = {}
+    for name, href, description in contestants:
+        url = urlparse(href)
+        params = parse_qs(url.query)
+        if "player_id" in params:
+            p_id = params["player_id"][0]
+        m = PATTERNS["contestant"].search(description)
+        occupation = m.group(1)
+        is_originally = m.group(2) != None
+        location = m.group(3)
+        player_ids[name] = p_id
+        game["players"].append([p_id, name, occupation, location, is_originally])
+    return player_ids
+
+def parse_scores(game, player_ids, names, nicknames, score_tables):
+    """Matches the score table nicknames to the contestants and adds their scores.
+
+    score_tables holds the texts of the score cells at the first commercial
+    break, the end of the Jeopardy! and Double Jeopardy! rounds, the final
+    scores and the Coryat scores, with None for the tables the game lacks.
+    Returns False when the nicknames could not all be matched to names.
+    """
+    total_players = len(names)
+    player_names = list(names)
+    matcher = NameMatcher(nicknames)
+
+    # Try to exact match player first names to nicknames
+    player_nicknames_to_names = {}
+    for name in reversed(names):
+        nickname = name.split()[0]
+        if nickname in matcher:
+            player_nicknames_to_names[nickname] = name
+            player_names.remove(name)
+            matcher.remove(nickname)
+
+    # If there's only one mismatch, match it up
+    if len(player_names) == 1 and len(matcher) == 1:
+        player_nicknames_to_names[matcher.keys[0]] = player_names.pop()
+        matcher.remove(matcher.keys[0])
+
+    # Then by the shortest start of the name only one nickname shares
+    for name in reversed(list(player_names)):
+        nickname = matcher.match(name)
+        if nickname is not None:
+            player_nicknames_to_names[nickname] = name
+            player_names.remove(name)
+            matcher.remove(nickname)
+        elif matcher.ambiguous(name):
+            count(game, "ambiguous_nicknames")
+
+    if len(player_names) > 0:
+        print("could not match all names to nicknames")
+        count(game, "unmatched_nicknames")
+        return False
     
-        player_scores = []
+    player_scores = []
     
-        for i in range(total_players):
-            player_scores.append([
-                scores_table_cb.find_all("td", class_="score_player_nickname")[i].get_text(),
-                int(scores_table_cb.find_all("td", class_=regex.compile("score_(positive|negative)"))[i].get_text().replace("$", "").replace(",", "")),
-                int(scores_table_j.find_all("td", class_=regex.compile("score_(positive|negative)"))[i].get_text().replace("$", "").replace(",", "")) if scores_table_j else None,
-                int(scores_table_dj.find_all("td", class_=regex.compile("score_(positive|negative)"))[i].get_text().replace("$", "").replace(",", "")) if scores_table_dj else None,
-                int(scores_table_fs.find_all("td", class_=regex.compile("score_(positive|negative)"))[i].get_text().replace("$", "").replace(",", "")) if scores_table_fs else None,
-                int(scores_table_cs.find_all("td", class_=regex.compile("score_(positive|negative)"))[i].get_text().replace("$", "").replace(",", "")) if scores_table_cs else None
-            ])
-
-        player_final_scores = []
-        
-        for i in range(total_players):
-            player_final_scores.append(player_scores[i][4])
+    for i in range(total_players):
+        player_scores.append([nicknames[i]] + [int(scores[i].replace("$", "").replace(",", "")) if scores is not None else None for scores in score_tables])
 
-        player_ranks = len(player_final_scores) - rankdata(player_final_scores, method="min").astype(int) + 1
-        
-        for i in range(total_players):
-        #for name, nickname in player_names_to_nicknames.items():
-            nickname = player_scores[i][0]
-            name = player_nicknames_to_names[nickname]
-            scores = player_scores[i]
-            p_id = player_ids[name]
-            sql.execute("UPDATE players SET nickname = ? WHERE player_id = ?;", (nickname, p_id,))
-            sql.execute("UPDATE game_players SET place = ?, first_break_score = ?, first_round_score = ?, second_round_score = ?, final_score = ?, coryat_score = ? WHERE game_id = ? AND player_id = ?;", (player_ranks.item(i), scores[1], scores[2], scores[3], scores[4], scores[5], gid, p_id,))
+    for i in range(total_players):
+    #for name, nickname in player_names_to_nicknames.items():
+        nickname = player_scores[i][0]
+        name = player_nicknames_to_names[nickname]
+        scores = player_scores[i]
+        p_id = player_ids[name]
+        # The places are filled in for every game at once after the load,
+        # see scores.rank()
+        game["scores"].append([p_id, nickname, None, scores[1], scores[2], scores[3], scores[4], scores[5]])
 
-        return len(contestants) >= 3 and scores_table_cb and scores_table_j and scores_table_dj and scores_table_fs and scores_table_cs
+    return True
 
-def parse_round(bsoup, sql, rnd, gid, game_number, air_date):
-    """Parses and inserts the list of clues from a whole round."""
+def parse_round(bsoup, game, rnd):
+    """Parses the list of clues from a whole round into the game."""
+    from bs4 import BeautifulSoup
     round_id = "jeopardy_round" if rnd == 1 else "double_jeopardy_round"
     r = bsoup.find(id=round_id)
     # The game may not have all the rounds
@@ -296,79 +618,19 @@ def parse_round(bsoup, sql, rnd, gid, game_number, air_date):
     for a in r.find_all("td", class_="clue"):
         is_missing = True if not a.get_text().strip() else False
         if not is_missing:
-            value = a.find("td", class_=regex.compile("clue_value")).get_text().lstrip("D: $").replace(",", "")
+            value = a.find("td", class_=PATTERNS["clue_value_class"]).get_text().lstrip("D: $").replace(",", "")
             is_dd = 1 if not not a.find("td", class_="clue_value_daily_double") else 0
-            order_number_td = a.find("td", class_=regex.compile("clue_order_number"))
+            order_number_td = a.find("td", class_=PATTERNS["clue_order_number_class"])
             order_number = order_number_td.find("a").get_text() if order_number_td.find("a") else order_number_td.get_text()
             text = a.find("td", class_="clue_text").get_text()
             answer = BeautifulSoup(a.find("div", onmouseover=True).get("onmouseover"), "lxml")
             right_player_td = answer.find("td", class_="right")
-            wrong_player_tds = answer.find_all("td", class_="wrong")
-            wrong_answers = []
-            
-            #print(text)
-            
-            for wrong_player_td in wrong_player_tds:
-                wrong_player_nickname = wrong_player_td.get_text().replace("\\'", "'")
-                if wrong_player_nickname == "Triple Stumper" or wrong_player_nickname == "Quadruple Stumper":
-                    wrong_player_tds.remove(wrong_player_td)
-
-            answer_table = regex.findall(".*'(\(.*?)(?=\<em)", str(answer).replace("\\'", "'"))
-            answer_table_text = str(answer_table[0]) if len(answer_table) > 0 else ""
-            wrong_answer_text_matches = regex.finditer("\((([^()]|(?R))*)\)", answer_table_text)
-            
-            wrong_answer_texts = []
-            
-            for match in wrong_answer_text_matches:
-                split = regex.findall("(.*?) ?[:;,-]+ ?(.*)", match.group(1))
-                if len(split) > 0 and len(split[0]) > 1:
-                    wrong_answer_texts.append([split[0][0], split[0][1]])
-                else:
-                    wrong_answer_texts.append(["(no name)", match.group(1)])
-
-            if len(wrong_player_tds) == 1:
-                wrong_player_nickname = wrong_player_tds[0].get_text().replace("\\'", "'")
-                wrong_answer_text = wrong_answer_texts[0][1] if len(wrong_answer_texts) > 0 else None
-                if wrong_answer_text:
-                    t = BeautifulSoup(wrong_answer_text, "lxml")
-                    wrong_answer_text = t.get_text()
-                wrong_answers.append([wrong_player_nickname, wrong_answer_text, ])
-            elif len(wrong_player_tds) > 1:
-                # Another hacky char-by-char match on wrong answers due to dirty data
-                for match in wrong_answer_texts:
-                    name = match[0]
-                    if name == "Alex":
-                        found_match = False
-                        for td in wrong_player_tds:
-                            if name == td.get_text():
-                                found_match = True
-                        if not found_match:
-                            continue
-                    for i in range(len(name)):
-                        matches_found = 0
-                        for td in wrong_player_tds:
-                            nickname = td.get_text().replace("\\'", "'")
-                            if name[:i+1] == nickname[:i+1]:
-                                wrong_player_nickname = nickname
-                                wrong_answer_text = match[1]
-                                if wrong_answer_text:
-                                    t = BeautifulSoup(wrong_answer_text, "lxml")
-                                    wrong_answer_text = t.get_text()
-                                matches_found += 1
-                        if matches_found == 1:
-                            break
-                    if matches_found == 1:
-                        wrong_answers.append([wrong_player_nickname, wrong_answer_text, ])
-                
-            right_player = right_player_td.get_text() if right_player_td else None
+            wrong_players = [td.get_text() for td in answer.find_all("td", class_="wrong")]
+            wrong_answers = match_wrong_answers(game, wrong_players, str(answer), soup_text)
+
+            right_player = right_player_td.get_text().replace("\\'", "'") if right_player_td else None
             answer = answer.find("em", class_="correct_response").get_text()
-            clue_id = insert(sql, [gid, air_date, rnd, categories[column], value, text, answer, game_number, right_player, order_number, is_dd, column+1, row+1])
-            
-            for wrong_answer in wrong_answers:
-                #print(str(gid) + ', ' + wrong_answer[0])
-                p_id = sql.execute("SELECT players.player_id FROM players JOIN game_players ON players.player_id = game_players.player_id AND game_players.game_id = ? WHERE (players.nickname = ? OR players.name = ?)", (gid, wrong_answer[0], wrong_answer[0], )).fetchone()[0]
-                #print("INSERT INTO clue_wrong_answers VALUES(" + str(clue_id) + ", " + str(p_id) + ", " + str(wrong_answer[1]) + ")")
-                sql.execute("INSERT OR IGNORE INTO clue_wrong_answers VALUES(?, ?, ?)", (clue_id, p_id, wrong_answer[1], ))
+            game["clues"].append(clue_record(rnd, column+1, row+1, value, is_dd, categories[column], order_number, text, answer, right_player, wrong_answers, []))
 
         # Always update x, even if we skip
         # a clue, as this keeps things in order. there
@@ -388,41 +650,903 @@ def parse_round(bsoup, sql, rnd, gid, game_number, air_date):
     return True
 
 
-def insert(sql, clue):
-    """Inserts the given clue into the database."""
-    # Clue is [game, air_date, round, category, value, clue, answer]
-    # Note that at this point, clue[4] is False if round is 3
-    if "\\\'" in clue[6]:
-        clue[6] = clue[6].replace("\\\'", "'")
-    if "\\\"" in clue[6]:
-        clue[6] = clue[6].replace("\\\"", "\"")
-    if not sql:
-        print(clue)
-        return
-    sql.execute("INSERT OR IGNORE INTO categories(category) VALUES(?);", (clue[3], ))
-    category_id = sql.execute("SELECT category_id FROM categories WHERE category=?;", (clue[3], )).fetchone()[0]
-    
-    right_player_id = sql.execute("SELECT players.player_id FROM players JOIN game_players ON game_players.player_id = players.player_id WHERE game_players.game_id=? AND players.nickname=?", (clue[0], clue[8].replace("\\'", "'"))).fetchone()[0] if clue[8] else None
-    clue_id = sql.execute("INSERT INTO clues(game_id, round, value, category_id, clue, answer, answer_player_id, order_number, is_daily_double, column, row) VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);", (clue[0], clue[2], clue[4], category_id, clue[5], clue[6], right_player_id, clue[9], clue[10], clue[11], clue[12], )).lastrowid
-    
-    return clue_id
+def match_wrong_answers(game, wrong_players, answer_source, fragment_text):
+    """Matches the wrong answers given on a clue to the players that gave them.
+
+    wrong_players are the texts of the clue's "wrong" cells, answer_source is
+    the clue's mouseover HTML and fragment_text turns a bit of that HTML into
+    plain text. Returns a list of [nickname, answer] pairs; the answers that
+    can't be matched to a player are counted in the game's counters.
+    """
+    wrong_players = [wrong_player for wrong_player in wrong_players
+                     if wrong_player.replace("\\'", "'") not in ("Triple Stumper", "Quadruple Stumper")]
+    wrong_answers = []
+
+    answer_table = PATTERNS["answer_table"].findall(answer_source.replace("\\'", "'"))
+    answer_table_text = str(answer_table[0]) if len(answer_table) > 0 else ""
+
+    wrong_answer_texts = []
+
+    for group in paren_groups(answer_table_text):
+        split = PATTERNS["name_answer"].findall(group)
+        if len(split) > 0 and len(split[0]) > 1:
+            wrong_answer_texts.append([split[0][0], split[0][1]])
+        else:
+            wrong_answer_texts.append(["(no name)", group])
+
+    if len(wrong_players) == 1:
+        wrong_player_nickname = wrong_players[0].replace("\\'", "'")
+        wrong_answer_text = wrong_answer_texts[0][1] if len(wrong_answer_texts) > 0 else None
+        if wrong_answer_text:
+            wrong_answer_text = fragment_text(wrong_answer_text)
+        wrong_answers.append([wrong_player_nickname, wrong_answer_text, ])
+    elif len(wrong_players) > 1:
+        # The names in the answers are often shortened or misspelt, so
+        # they're matched to the players by how they start
+        matcher = NameMatcher([wrong_player.replace("\\'", "'") for wrong_player in wrong_players])
+        for name, wrong_answer_text in wrong_answer_texts:
+            # Alex's remarks are only wrong answers when a player is called Alex
+            if name == "Alex" and name not in wrong_players:
+                continue
+            wrong_player_nickname = matcher.match(name)
+            if wrong_player_nickname is None:
+                count(game, "ambiguous_wrong_answers" if matcher.ambiguous(name) else "skipped_wrong_answers")
+                continue
+            if wrong_answer_text:
+                wrong_answer_text = fragment_text(wrong_answer_text)
+            wrong_answers.append([wrong_player_nickname, wrong_answer_text, ])
+    return wrong_answers
+
+class NameMatcher(object):
+    """Matches names to the keys (nicknames) they start like.
+
+    A name matches the one key that shares the shortest start of it with no
+    other key: "Rob" matches "Robert" out of "Robert" and "Ruth". The keys
+    are kept sorted, so the keys starting with each longer part of the name
+    are a narrowing range found by bisection. Keys can be listed more than
+    once and are removed one at a time once they're matched.
+    """
+
+    def __init__(self, keys):
+        self.keys = sorted(keys)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        i = bisect.bisect_left(self.keys, key)
+        return i < len(self.keys) and self.keys[i] == key
+
+    def remove(self, key):
+        del self.keys[bisect.bisect_left(self.keys, key)]
+
+    def starting_with(self, name):
+        """Returns the range of keys starting with each part of the name, shortest first."""
+        lo, hi = 0, len(self.keys)
+        for i in range(1, len(name) + 1):
+            prefix = name[:i]
+            lo = bisect.bisect_left(self.keys, prefix, lo, hi)
+            hi = bisect.bisect_left(self.keys, prefix + MAX_CHAR, lo, hi)
+            yield lo, hi
+
+    def match(self, name):
+        """Returns the key the name matches, None when none or several do."""
+        for lo, hi in self.starting_with(name):
+            if hi - lo == 1:
+                return self.keys[lo]
+            if hi == lo:
+                return None
+        return None
+
+    def ambiguous(self, name):
+        """Whether several keys start with the whole name, so it can't be matched."""
+        ranges = list(self.starting_with(name))
+        return bool(ranges) and ranges[-1][1] - ranges[-1][0] > 1
+
+
+# Sorts after every character, for the end of a range of keys
+MAX_CHAR = chr(0x10FFFF)
+
+def count(game, counter, n=1):
+    """Adds n to one of the game's counters."""
+    game["counters"][counter] = game["counters"].get(counter, 0) + n
+
+
+def paren_groups(text):
+    r"""Returns the text inside each top-level pair of parentheses.
+
+    Gives the same groups as finditer with the recursive pattern
+    \((([^()]|(?R))*)\), in linear time: an opening parenthesis that is never
+    closed is skipped, and groups nested in a match are part of it.
+    """
+    closes = {}
+    opened = []
+    for paren in PATTERNS["parens"].finditer(text):
+        if paren.group() == "(":
+            opened.append(paren.start())
+        elif opened:
+            closes[opened.pop()] = paren.start()
+    groups = []
+    end = -1
+    for start in sorted(closes):
+        if start > end:
+            end = closes[start]
+            groups.append(text[start + 1:end])
+    return groups
+
+
+def soup_text(html):
+    """Returns the text of an HTML fragment."""
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(html, "lxml").get_text()
+
+
+def has_class(name):
+    """Returns an XPath test for elements with the given class."""
+    return "contains(concat(' ', normalize-space(@class), ' '), ' %s ')" % name
+
+class XPath(object):
+    """An lxml XPath selector, compiled the first time it's used."""
+
+    def __init__(self, path):
+        self.path = path
+        self.compiled = None
+
+    def __call__(self, *args, **kwargs):
+        if self.compiled is None:
+            from lxml import etree
+            self.compiled = etree.XPath(self.path)
+        return self.compiled(*args, **kwargs)
+
+# The lxml-fast engine's selectors, compiled once instead of per page
+TITLE = XPath("//title")
+GAME_COMMENTS = XPath("//div[@id = 'game_comments']")
+CONTESTANTS = XPath("//p[%s]" % has_class("contestants"))
+H3S = XPath("//h3")
+LINKS = XPath("//a")
+NICKNAME_CELLS = XPath(".//td[%s]" % has_class("score_player_nickname"))
+SCORE_CELLS = XPath(".//td[contains(@class, 'score_positive') or contains(@class, 'score_negative')]")
+ROUND = XPath("//*[@id = $id]")
+CATEGORY_NAMES = XPath(".//td[%s]" % has_class("category_name"))
+CLUES = XPath(".//td[%s]" % has_class("clue"))
+CLUE_VALUE = XPath(".//td[contains(@class, 'clue_value')]")
+DAILY_DOUBLE = XPath(".//td[%s]" % has_class("clue_value_daily_double"))
+ORDER_NUMBER = XPath(".//td[contains(@class, 'clue_order_number')]")
+CLUE_TEXT = XPath(".//td[%s]" % has_class("clue_text"))
+MOUSEOVER = XPath(".//div[@onmouseover]")
+RIGHT = XPath(".//td[%s]" % has_class("right"))
+WRONG = XPath(".//td[%s]" % has_class("wrong"))
+CORRECT_RESPONSE = XPath(".//em[%s]" % has_class("correct_response"))
+FINAL_ROUND = XPath("//table[%s]" % has_class("final_round"))
+
+
+
+def parse_game_lxml(f, gid):
+    """Parses a game like parse_game(), using lxml.html directly.
+
+    Each page and each clue's mouseover is parsed once, and the elements are
+    found with the precompiled XPath selectors above; the records are the
+    same as the ones the BeautifulSoup engine builds.
+    """
+    doc = read_tree(f)
+
+    title_parts = text_of(TITLE(doc)[0]).split()
+    air_date = title_parts[-1]
+    game_number = title_parts[-3].replace("#", "").replace(",", "")
+    notes = text_of(GAME_COMMENTS(doc)[0])
+    notes = None if notes == "" else notes
+
+    game = {
+        "game_id": gid,
+        "air_number": game_number,
+        "air_date": air_date,
+        "notes": notes,
+        "players": [],
+        "scores": [],
+        "clues": [],
+        "complete": False,
+        # Things worth knowing about that didn't stop the game being parsed
+        "counters": {},
+    }
+    player_data_complete = parse_players_lxml(doc, game)
+    round_data_complete = parse_round_lxml(doc, game, 1) and parse_round_lxml(doc, game, 2)
+    if not parse_final_round_lxml(doc, game):
+        # This game does not have a final clue
+        return game
+    game["complete"] = bool(player_data_complete and round_data_complete)
+    return game
+
+def read_tree(f):
+    import lxml.html
+    return lxml.html.document_fromstring(f.read())
+
+def parse_final_round_lxml(doc, game):
+    import lxml.html
+    r = FINAL_ROUND(doc)
+    if not r:
+        return False
+    r = r[0]
+    category = text_of(CATEGORY_NAMES(r)[0])
+    text = text_of(CLUE_TEXT(r)[0])
+    fragment = lxml.html.document_fromstring(MOUSEOVER(r)[0].get("onmouseover"))
+    answer = text_of(fragment.find(".//em"))
+    final_answers = []
+    game["clues"].append(clue_record(3, None, None, None, 0, category, None, text, answer, None, [], final_answers))
+
+    fr_trs = fragment.findall(".//tr")
+    for i in range(int(len(fr_trs) / 2)):
+        first_tr = fr_trs[(i*2)]
+        second_tr = fr_trs[(i*2)+1]
+        first_tr_tds = first_tr.findall(".//td")
+
+        name = text_of(first_tr_tds[0]).replace("\\'", "'")
+        answer = text_of(first_tr_tds[1])
+        wager = text_of(second_tr.find(".//td")).replace("$", "").replace(",", "")
+        is_correct = 1 if RIGHT(first_tr) else 0
+        final_answers.append([name, answer, wager, is_correct])
+    return True
+
+def parse_players_lxml(doc, game):
+    contestants = CONTESTANTS(doc)
+    player_ids = parse_contestants(game, [(text_of(p.find(".//a")), p.find(".//a").get("href"), contestant_description(p)) for p in contestants])
+
+    st_h3_cb = st_h3_j = st_h3_dj = st_h3_fs = None
+    for h3 in H3S(doc):
+        string = tag_string(h3)
+        if string is None:
+            continue
+        if st_h3_cb is None and PATTERNS["scores_first_break"].search(string):
+            st_h3_cb = h3
+        if st_h3_j is None and PATTERNS["scores_jeopardy"].search(string):
+            st_h3_j = h3
+        if st_h3_dj is None and PATTERNS["scores_double_jeopardy"].search(string):
+            st_h3_dj = h3
+        if st_h3_fs is None and PATTERNS["scores_final"].search(string):
+            st_h3_fs = h3
+    st_h3_cs = None
+    for a in LINKS(doc):
+        if tag_string(a) == "Coryat scores":
+            st_h3_cs = a.getparent()
+            break
+
+    scores_table_cb = table_after(st_h3_cb)
+    scores_table_j = table_after(st_h3_j)
+    scores_table_dj = table_after(st_h3_dj)
+    scores_table_fs = table_after(st_h3_fs)
+    scores_table_cs = table_after(st_h3_cs)
+
+    if scores_table_cb is not None:
+        player_names = [text_of(p.find(".//a")) for p in contestants]
+        player_nicknames = [text_of(td) for td in NICKNAME_CELLS(scores_table_cb)]
+        score_tables = []
+        for table in (scores_table_cb, scores_table_j, scores_table_dj, scores_table_fs, scores_table_cs):
+            score_tables.append([text_of(td) for td in SCORE_CELLS(table)] if table is not None else None)
+        if not parse_scores(game, player_ids, player_names, player_nicknames, score_tables):
+            return
+
+        return len(contestants) >= 3 and all(table is not None for table in (scores_table_j, scores_table_dj, scores_table_fs, scores_table_cs))
+
+def parse_round_lxml(doc, game, rnd):
+    """Parses the list of clues from a whole round into the game."""
+    import lxml.html
+    round_id = "jeopardy_round" if rnd == 1 else "double_jeopardy_round"
+    r = ROUND(doc, id=round_id)
+    # The game may not have all the rounds
+    if not r:
+        return False
+    r = r[0]
+    categories = [text_of(c) for c in CATEGORY_NAMES(r)]
+    column = 0
+    row = 0
+    for a in CLUES(r):
+        if text_of(a).strip():
+            value = text_of(CLUE_VALUE(a)[0]).lstrip("D: $").replace(",", "")
+            is_dd = 1 if DAILY_DOUBLE(a) else 0
+            order_number_td = ORDER_NUMBER(a)[0]
+            order_number_a = order_number_td.find(".//a")
+            order_number = text_of(order_number_a if order_number_a is not None else order_number_td)
+            text = text_of(CLUE_TEXT(a)[0])
+            mouseover = MOUSEOVER(a)[0].get("onmouseover")
+            fragment = lxml.html.document_fromstring(mouseover)
+            right_player_td = RIGHT(fragment)
+            wrong_players = [text_of(td) for td in WRONG(fragment)]
+            # The wrong answers are pulled from the mouseover as it is, rather
+            # than from the fragment serialized back to HTML
+            wrong_answers = match_wrong_answers(game, wrong_players, mouseover, lxml_text)
+
+            right_player = text_of(right_player_td[0]).replace("\\'", "'") if right_player_td else None
+            answer = text_of(CORRECT_RESPONSE(fragment)[0])
+            game["clues"].append(clue_record(rnd, column+1, row+1, value, is_dd, categories[column], order_number, text, answer, right_player, wrong_answers, []))
+
+        if column == 5:
+            column = 0
+            row += 1
+        else:
+            column += 1
+    return True
+
+
+def text_of(element):
+    """Returns the text of an lxml element as a plain (picklable) str."""
+    return str(element.text_content())
+
+
+def lxml_text(html):
+    """Returns the text of an HTML fragment."""
+    import lxml.html
+    from lxml import etree
+    try:
+        return text_of(lxml.html.document_fromstring(html))
+    except etree.ParserError:
+        # Whitespace only
+        return ""
+
+
+def tag_string(element):
+    """Returns what BeautifulSoup's .string would be for the element."""
+    if len(element) == 0:
+        return element.text
+    if len(element) == 1 and not element.text and not element[0].tail:
+        return tag_string(element[0])
+    return None
+
+
+def table_after(h3):
+    """Returns the scores table following the heading, if there is one.
+
+    Mirrors BeautifulSoup's h3.next_sibling.next_sibling, which skips the
+    whitespace between the heading and the table.
+    """
+    if h3 is None:
+        return None
+    if h3.tail:
+        return h3.getnext()
+    following = h3.getnext()
+    if following is None or following.tail:
+        return None
+    return following.getnext()
+
+
+def contestant_description(p):
+    """Returns the text after the contestant's name, e.g. ", a teacher from Austin".
+
+    The contestant's first child is the link with their name; any other
+    markup (e.g. <i>) in the description is flattened to its text.
+    """
+    parts = [p.text] if p.text else []
+    for child in p:
+        parts.append(child)
+        if child.tail:
+            parts.append(child.tail)
+    return "".join(part if isinstance(part, str) else text_of(part) for part in parts[1:])
+
+
+def clue_record(rnd, column, row, value, is_dd, category, order_number, text, answer, right_player, wrong_answers, final_answers):
+    """Builds the record for a single clue of a parsed game."""
+    if "\\\'" in answer:
+        answer = answer.replace("\\\'", "'")
+    if "\\\"" in answer:
+        answer = answer.replace("\\\"", "\"")
+    return {
+        "round": rnd,
+        "column": column,
+        "row": row,
+        "value": value,
+        "is_daily_double": is_dd,
+        "category": category,
+        "order_number": order_number,
+        "clue": text,
+        "answer": answer,
+        "answer_player": right_player,
+        # [nickname, answer] pairs
+        "wrong_answers": wrong_answers,
+        # [name, answer, wager, is_correct] lists, only in the final round
+        "final_answers": final_answers,
+    }
+
+
+# The functions that turn a game file into a parsed game
+ENGINES = {
+    "bs4": parse_game,
+    "lxml-fast": parse_game_lxml,
+}
+
+DATABASE = "output/database.db"
+
+# The number of functions --profile prints
+PROFILE_LINES = 25
+
+# Opt-in settings that trade durability for load speed: a crash mid-load can
+# leave the database unusable, but it's rebuilt from the game files anyway
+FAST_LOAD_PRAGMAS = [
+    "PRAGMA journal_mode = WAL;",
+    "PRAGMA synchronous = OFF;",
+    "PRAGMA cache_size = -65536;",
+    "PRAGMA temp_store = MEMORY;",
+]
+
+# Removes everything that was loaded from a game file that has changed
+DELETES = [
+    "DELETE FROM clue_wrong_answers WHERE clue_id IN (SELECT clue_id FROM clues WHERE game_id = ?);",
+    "DELETE FROM final_jeopardy_answers WHERE clue_id IN (SELECT clue_id FROM clues WHERE game_id = ?);",
+    "DELETE FROM clues WHERE game_id = ?;",
+    "DELETE FROM game_players WHERE game_id = ?;",
+    "DELETE FROM games WHERE game_id = ?;",
+]
+
+# The range of games a shard database was built from
+CREATE_SHARDS = """CREATE TABLE IF NOT EXISTS shards(
+    first_game INTEGER,
+    last_game INTEGER,
+    first_date TEXT,
+    last_date TEXT
+);"""
+
+# A shard's clue ids are the game id times this plus the clue's number in
+# the game, so they don't collide across shards
+CLUES_PER_GAME = 1000
+
+# Created once the load is done rather than maintained row by row
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS clues_game_id ON clues(game_id);",
+    "CREATE INDEX IF NOT EXISTS game_players_player_id ON game_players(player_id);",
+]
+
+# The buffered rows are written table by table in this order, so the rows a
+# foreign key points to are always there first
+STATEMENTS = [
+    ("games", "INSERT OR IGNORE INTO games VALUES(?, ?, ?, ?, ?);"),
+    ("players", "INSERT OR IGNORE INTO players(player_id, name, occupation, location, is_originally) VALUES(?, ?, ?, ?, ?);"),
+    ("nicknames", "UPDATE players SET nickname = ? WHERE player_id = ?;"),
+    ("game_players", "INSERT OR IGNORE INTO game_players VALUES(?, ?, ?, ?, ?, ?, ?, ?);"),
+    ("categories", "INSERT INTO categories(category_id, category) VALUES(?, ?);"),
+    ("clues", "INSERT INTO clues(clue_id, game_id, round, value, category_id, clue, answer, answer_player_id, order_number, is_daily_double, column, row) VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);"),
+    ("clue_wrong_answers", "INSERT OR IGNORE INTO clue_wrong_answers VALUES(?, ?, ?);"),
+    ("final_jeopardy_answers", "INSERT INTO final_jeopardy_answers(clue_id, player_id, answer, wager, is_correct) VALUES(?, ?, ?, ?, ?);"),
+    ("game_files", "INSERT OR REPLACE INTO game_files VALUES(?, ?, ?, ?);"),
+    ("unquarantined", "DELETE FROM quarantine WHERE game_id = ?;"),
+]
+
+
+class Writer(object):
+    """Buffers the rows of parsed games and writes them in batches.
+
+    Category, clue and player ids are resolved in memory and come out the
+    same as the ones the per-clue INSERT OR IGNORE and SELECT statements used
+    to produce. Each batch of games is written with executemany and committed
+    as a single transaction.
+
+    For a shard, the category and clue ids are worked out from the category
+    and the game instead (see category_key and CLUES_PER_GAME), so shards
+    built apart can be merged.
+
+    A game's rows are all worked out before any of them are buffered, and
+    if a batch fails to write it's written again a game at a time, each in
+    a savepoint, so a bad game is rolled back on its own and quarantined.
+    """
+
+    def __init__(self, sql, batch_size=100, shard=False):
+        self.sql = sql
+        self.batch_size = batch_size
+        self.shard = shard
+        self.games = 0
+        # The buffered games' (game id, rows by table, search rows)
+        self.batch = []
+        self.deleted = []
+        self.quarantined = []
+        self.write_failures = 0
+        # The time spent in executemany and commit, all batches together
+        self.write_seconds = 0
+        # Once a database has a search index it's kept up to date
+        self.search = search.has_index(sql)
+        self.category_ids = {}
+        for category_id, category in sql.execute("SELECT category_id, category FROM categories;"):
+            self.category_ids[category] = category_id
+        # Every clue used to run an INSERT OR IGNORE into categories, which
+        # bumps the AUTOINCREMENT sequence even when the row is ignored
+        self.category_seq = self.sequence("categories")
+        self.clue_seq = self.sequence("clues")
+        # What the players table holds: the first name seen for a player and
+        # the last nickname seen for them
+        self.player_names = {}
+        self.player_nicknames = {}
+        for p_id, name, nickname in sql.execute("SELECT player_id, name, nickname FROM players;"):
+            self.player_names[p_id] = name
+            self.player_nicknames[p_id] = nickname
+
+    def sequence(self, table):
+        """Returns the last AUTOINCREMENT id handed out for the table."""
+        row = self.sql.execute("SELECT seq FROM sqlite_sequence WHERE name = ?;", (table, )).fetchone()
+        return row[0] if row else 0
+
+    def delete_game(self, gid):
+        """Removes a game before it's loaded again, with the next batch."""
+        self.deleted.append((gid, ))
+
+    def record_file(self, gid, state):
+        """Buffers the (size, mtime, hash) of the game file for gid."""
+        self.batch.append((gid, {"game_files": [(gid, ) + tuple(state)]}, []))
+
+    def quarantine(self, gid, stage, error):
+        """Records a game that couldn't be loaded, with the next batch."""
+        self.quarantined.append((gid, stage, error, ))
+
+    def insert_game(self, game, state=None):
+        """Buffers a parsed game, writing the batch once it's full.
+
+        state is the (size, mtime, hash) of the game file, if it's known.
+        Nothing is buffered, and the ids handed out stay the same, if the
+        game raises an exception.
+        """
+        gid = game["game_id"]
+        rows = dict((table, []) for table, _ in STATEMENTS)
+        search_rows = []
+        if state:
+            rows["game_files"].append((gid, ) + tuple(state))
+        rows["unquarantined"].append((gid, ))
+        rows["games"].append((gid, game["air_number"], game["air_date"], 1 if game["complete"] else 0, game["notes"], ))
+        game_players = {}
+        player_names = {}
+        player_nicknames = {}
+        for p_id, name, occupation, location, is_originally in game["players"]:
+            rows["players"].append((p_id, name, occupation, location, is_originally, ))
+            player_names.setdefault(int(p_id), self.player_names.get(int(p_id), name))
+            game_players.setdefault(int(p_id), [gid, p_id, None, None, None, None, None, None])
+        for p_id, nickname, place, first_break, first_round, second_round, final, coryat in game["scores"]:
+            rows["nicknames"].append((nickname, p_id, ))
+            player_nicknames[int(p_id)] = nickname
+            game_players[int(p_id)][2:] = [place, first_break, first_round, second_round, final, coryat]
+        rows["game_players"].extend(game_players.values())
+
+        nicknames = {}
+        names = {}
+        for p_id in game_players:
+            nicknames.setdefault(player_nicknames.get(p_id, self.player_nicknames.get(p_id)), p_id)
+            names.setdefault(player_names[p_id], p_id)
+
+        category_ids = {}
+        category_seq = self.category_seq
+        clue_seq = self.clue_seq
+        for number, clue in enumerate(game["clues"], 1):
+            category_id = self.category_ids.get(clue["category"], category_ids.get(clue["category"]))
+            if self.shard:
+                if category_id is None:
+                    category_id = category_ids[clue["category"]] = category_key(clue["category"])
+                    rows["categories"].append((category_id, clue["category"], ))
+                clue_id = gid * CLUES_PER_GAME + number
+            else:
+                category_seq += 1
+                if category_id is None:
+                    category_id = category_ids[clue["category"]] = category_seq
+                    rows["categories"].append((category_seq, clue["category"], ))
+                clue_seq += 1
+                clue_id = clue_seq
+            right_player_id = nicknames[clue["answer_player"]] if clue["answer_player"] else None
+            rows["clues"].append((clue_id, gid, clue["round"], clue["value"], category_id, clue["clue"], clue["answer"], right_player_id, clue["order_number"], clue["is_daily_double"], clue["column"], clue["row"], ))
+            wrong_answers = {}
+            for name, answer in clue["wrong_answers"]:
+                p_id = nicknames[name] if name in nicknames else names[name]
+                rows["clue_wrong_answers"].append((clue_id, p_id, answer, ))
+                # What INSERT OR IGNORE keeps
+                wrong_answers.setdefault(p_id, answer)
+            for name, answer, wager, is_correct in clue["final_answers"]:
+                p_id = nicknames[name] if name in nicknames else names[name]
+                rows["final_jeopardy_answers"].append((clue_id, p_id, answer, wager, is_correct, ))
+            if self.search:
+                wrong_answers = " / ".join(answer for answer in wrong_answers.values() if answer)
+                search_rows.append((clue_id, clue["clue"], clue["answer"], wrong_answers or None, clue["category"], ))
+
+        self.player_names.update(player_names)
+        self.player_nicknames.update(player_nicknames)
+        self.category_ids.update(category_ids)
+        self.category_seq = category_seq
+        self.clue_seq = clue_seq
+        self.batch.append((gid, rows, search_rows))
+        self.games += 1
+        if self.games >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered rows and commits them.
+
+        If the batch fails, it's rolled back and written a game at a time.
+        """
+        start = time.perf_counter()
+        try:
+            self.write(self.batch)
+        except sqlite3.Error:
+            self.sql.rollback()
+            self.write(self.batch, isolated=True)
+        if not self.shard:
+            self.sql.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'categories';", (self.category_seq, ))
+        self.sql.executemany("INSERT OR REPLACE INTO quarantine VALUES(?, ?, ?);", self.quarantined)
+        self.sql.commit()
+        self.batch = []
+        self.deleted = []
+        self.quarantined = []
+        self.games = 0
+        self.write_seconds += time.perf_counter() - start
+
+    def write(self, batch, isolated=False):
+        """Writes the games in the batch, table by table, or each in its own
+        savepoint and quarantining the ones that fail if isolated."""
+        if self.search:
+            self.sql.executemany(search.DELETE, self.deleted)
+        for statement in DELETES:
+            self.sql.executemany(statement, self.deleted)
+        if not isolated:
+            for table, statement in STATEMENTS:
+                self.sql.executemany(statement, (row for _, rows, _ in batch for row in rows.get(table, ())))
+            if self.search:
+                self.sql.executemany(search.INSERT, (row for _, _, search_rows in batch for row in search_rows))
+            return
+        # The categories go in first, any game in the batch may use them
+        self.sql.executemany(dict(STATEMENTS)["categories"], (row for _, rows, _ in batch for row in rows.get("categories", ())))
+        for gid, rows, search_rows in batch:
+            table = None
+            self.sql.execute("SAVEPOINT game;")
+            try:
+                for table, statement in STATEMENTS:
+                    if table != "categories":
+                        self.sql.executemany(statement, rows.get(table, ()))
+                table = "clue_search"
+                if self.search:
+                    self.sql.executemany(search.INSERT, search_rows)
+            except sqlite3.Error as e:
+                self.sql.execute("ROLLBACK TO game;")
+                stage, error = "writing %s" % table, "%s: %s" % (type(e).__name__, e)
+                print("Quarantined game %s, %s failed: %s" % (gid, stage, error))
+                self.quarantine(gid, stage, error)
+                self.write_failures += 1
+            self.sql.execute("RELEASE game;")
+
+    def close(self):
+        pass
+
+
+class JsonLinesSink(object):
+    """Writes each parsed game as a line of JSON as soon as it comes in.
+
+    Nothing is kept between games, so memory use doesn't grow with the
+    archive. The places are worked out per game here, since there's no
+    ranking stage after the load.
+    """
+
+    # The lines are written as the games come in, see insert_seconds
+    write_seconds = 0
+
+    def __init__(self, path):
+        self.to_stdout = path == "-"
+        self.f = sys.stdout if self.to_stdout else open(path, "w", encoding="utf-8")
+
+    def insert_game(self, game, state=None):
+        self.f.write(json.dumps(game_record(game), ensure_ascii=False))
+        self.f.write("\n")
+
+    def quarantine(self, gid, stage, error):
+        pass
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.flush()
+        if not self.to_stdout:
+            self.f.close()
+
+
+class NullSink(object):
+    """Throws the parsed games away, for timing the parser on its own."""
+
+    write_seconds = 0
+
+    def insert_game(self, game, state=None):
+        pass
+
+    def quarantine(self, gid, stage, error):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+SINKS = ["jsonl", "null", "sqlite"]
+
+def game_record(game):
+    """Returns a parsed game as the plain JSON-able record the JSON Lines sink writes."""
+    finals = [score[6] for score in game["scores"]]
+    clues = []
+    for clue in game["clues"]:
+        clue = dict(clue)
+        clue["value"] = number(clue["value"])
+        clue["order_number"] = number(clue["order_number"])
+        clue["wrong_answers"] = [{"nickname": nickname, "answer": answer} for nickname, answer in clue["wrong_answers"]]
+        clue["final_answers"] = [{"name": name, "answer": answer, "wager": number(wager), "is_correct": is_correct}
+                                 for name, answer, wager, is_correct in clue["final_answers"]]
+        clues.append(clue)
+    return {
+        "game_id": game["game_id"],
+        "air_number": number(game["air_number"]),
+        "air_date": game["air_date"],
+        "notes": game["notes"],
+        "complete": game["complete"],
+        "players": [{"player_id": number(p_id), "name": name, "occupation": occupation, "location": location, "is_originally": is_originally}
+                    for p_id, name, occupation, location, is_originally in game["players"]],
+        "scores": [{
+            "player_id": number(p_id),
+            "nickname": nickname,
+            # What scores.rank() works out for the database
+            "place": sum(1 for other in finals if other >= final) if final is not None else None,
+            "first_break_score": first_break,
+            "first_round_score": first_round,
+            "second_round_score": second_round,
+            "final_score": final,
+            "coryat_score": coryat,
+        } for p_id, nickname, _, first_break, first_round, second_round, final, coryat in game["scores"]],
+        "clues": clues,
+        "counters": game["counters"],
+    }
+
+def number(text):
+    """Returns text as an int if it's a whole number, otherwise as it is."""
+    try:
+        return int(text)
+    except (TypeError, ValueError):
+        return text
+
+class Stats(object):
+    """Collects how long each game took and what went wrong parsing it.
+
+    Only made with --stats; the parser itself just keeps a parse time and a
+    dict of counters in each game.
+    """
+
+    def __init__(self, slowest=10):
+        self.start = time.perf_counter()
+        self.slowest = slowest
+        # A min-heap of the slowest games' (parse seconds, game id, rows)
+        self.slowest_games = []
+        self.games = 0
+        self.incomplete_games = 0
+        self.quarantined_games = 0
+        self.rows = 0
+        self.parse_seconds = 0
+        self.insert_seconds = 0
+        self.write_seconds = 0
+        self.finish_seconds = 0
+        self.counters = {}
+
+    def add_game(self, game, insert_seconds=0):
+        rows = game_rows(game)
+        seconds = game.get("parse_seconds", 0)
+        self.games += 1
+        self.rows += rows
+        self.parse_seconds += seconds
+        self.insert_seconds += insert_seconds
+        if not game["complete"]:
+            self.incomplete_games += 1
+        for counter, n in game["counters"].items():
+            self.counters[counter] = self.counters.get(counter, 0) + n
+        entry = (seconds, game["game_id"], rows)
+        if len(self.slowest_games) < self.slowest:
+            heapq.heappush(self.slowest_games, entry)
+        elif self.slowest_games:
+            heapq.heappushpop(self.slowest_games, entry)
+
+    def summary(self):
+        wall_seconds = time.perf_counter() - self.start
+        return {
+            "games": self.games,
+            "incomplete_games": self.incomplete_games,
+            "quarantined_games": self.quarantined_games,
+            "rows_written": self.rows,
+            "wall_seconds": wall_seconds,
+            "games_per_second": self.games / wall_seconds if wall_seconds else 0,
+            # Summed over the workers, so more than the wall time with --jobs
+            "parse_seconds": self.parse_seconds,
+            # Working out a game's rows and buffering them
+            "insert_seconds": self.insert_seconds,
+            # Writing the batches to SQLite and committing them
+            "write_seconds": self.write_seconds,
+            # Ranking, indexes and the other post-load stages
+            "finish_seconds": self.finish_seconds,
+            "counters": self.counters,
+            "slowest_games": [{"game_id": gid, "parse_seconds": seconds, "rows": rows}
+                              for seconds, gid, rows in sorted(self.slowest_games, reverse=True)],
+        }
+
+    def report(self, path):
+        """Prints the slowest games and saves the summary as JSON to path."""
+        summary = self.summary()
+        print("Slowest games:")
+        for game in summary["slowest_games"]:
+            print("  %(game_id)s: %(parse_seconds).3fs, %(rows)s rows" % game)
+        for counter, n in sorted(summary["counters"].items()):
+            print("%s: %d" % (counter, n))
+        print("incomplete games: %d" % summary["incomplete_games"])
+        print("parse %(parse_seconds).2fs, insert %(insert_seconds).2fs, write %(write_seconds).2fs, finish %(finish_seconds).2fs" % summary)
+        print("quarantined games: %d" % summary["quarantined_games"])
+        if path == "-":
+            print(json.dumps(summary, indent=1, sort_keys=True))
+            return
+        with open(path, "w") as f:
+            json.dump(summary, f, indent=1, sort_keys=True)
+        print("Saved the stats to", path)
+
+def game_rows(game):
+    """Returns the number of rows written for a game."""
+    rows = 1 + 2 * len(game["players"]) + len(game["clues"])
+    for clue in game["clues"]:
+        rows += len(clue["wrong_answers"]) + len(clue["final_answers"])
+    return rows
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Parse games from the J! Archive website.", add_help=False,
         usage="%(prog)s [options]")
     parser.add_argument("-d", "--dir", dest="dir", metavar="<folder>",
-                        help="the directory containing the game files",
+                        help="the directory containing the game files, or a .db page store",
                         default="j-archive")
     parser.add_argument("-n", "--number-of-files", dest="num_of_files",
                         metavar="<number>", help="the number of files to parse",
                         type=int)
     parser.add_argument("-f", "--filename", dest="database",
                         metavar="<filename>",
-                        help="the filename for the SQLite database",
-                        default="output/database.db")
+                        help="the filename for the SQLite database (%s by default), or for the JSON Lines output (- for stdout, the default)" % DATABASE.replace("%", "%%"))
+    parser.add_argument("-j", "--jobs", dest="jobs", metavar="<number>",
+                        help="the number of worker processes parsing games",
+                        type=int, default=1)
+    parser.add_argument("-b", "--batch-size", dest="batch_size",
+                        metavar="<number>",
+                        help="the number of games written per transaction",
+                        type=int, default=100)
+    parser.add_argument("--fast-load", dest="fast_load",
+                        help="turn off the SQLite safety settings while loading",
+                        action="store_true")
+    parser.add_argument("-e", "--engine", dest="engine",
+                        choices=sorted(ENGINES),
+                        help="how the game files are parsed: with BeautifulSoup (the default) or with lxml directly",
+                        default="bs4")
+    parser.add_argument("-i", "--incremental",
+                        help="only parse the game files that are new or have changed since the last run",
+                        action="store_true")
+    parser.add_argument("--shard-games", dest="shard_games", metavar="<first:last>",
+                        type=shard_range(int),
+                        help="build a shard of the database from the games with ids in the range, for merge.py")
+    parser.add_argument("--shard-dates", dest="shard_dates", metavar="<first:last>",
+                        type=shard_range(str),
+                        help="build a shard of the database from the games aired in the range, e.g. 1984-09-01:1999-08-31")
+    parser.add_argument("--retry-quarantined", dest="retry_quarantined",
+                        help="only parse the games the last runs quarantined because they failed",
+                        action="store_true")
+    parser.add_argument("--check-scores", dest="check_scores",
+                        help="check the scraped scores against the ones the clues add up to, see scores.py",
+                        action="store_true")
+    parser.add_argument("-a", "--analytics",
+                        help="index the database for analysis and build its summary tables after loading, see analytics.py",
+                        action="store_true")
+    parser.add_argument("-s", "--search",
+                        help="build a full-text search index of the clues, see search.py",
+                        action="store_true")
+    parser.add_argument("--cache", dest="cache", metavar="<filename>",
+                        help="keep the parsed games in a cache file and only parse the pages that (or when the parser) changed since, see cache.py")
+    parser.add_argument("--cache-size", dest="cache_size", metavar="<MB>",
+                        help="the size the cache is cut back to after a run, least recently used games first",
+                        type=int, default=512)
+    parser.add_argument("--stats", dest="stats", metavar="<filename>",
+                        help="save a JSON summary of the run (parse times, rows written, problems found) to the file, - for stdout")
+    parser.add_argument("--slowest", dest="slowest", metavar="<number>",
+                        help="the number of slowest games listed with --stats",
+                        type=int, default=10)
+    parser.add_argument("--profile", dest="profile", metavar="<filename>",
+                        help="run under cProfile and save the profile to the file (the workers aren't profiled with --jobs)")
+    parser.add_argument("--sink", dest="sink", choices=SINKS,
+                        help="where the parsed games go: the SQLite database (the default), JSON Lines with a game per line, or nowhere, for timing the parser",
+                        default="sqlite")
     parser.add_argument("--stdout",
-                        help="output the clues to stdout and not a database",
+                        help="output the games to stdout as JSON Lines and not a database, the same as --sink jsonl -f -",
                         action="store_true")
     parser.add_argument("--help", action="help",
                         help="show this help message and exit")
@@ -0,0 +1,139 @@
+#!/usr/bin/env python -OO
+# -*- coding: utf-8 -*-
+
+import argparse
+import os
+import sqlite3
+import sys
+
+import numpy
+
+# The clue values doubled on this date, which changes what a Daily Double's
+# natural value (the one Coryat scores count) is
+VALUES_DOUBLED = "2001-11-26"
+
+# The scraped game_players columns that are checked against the clues
+CHECKED_SCORES = ["first_round_score", "second_round_score", "final_score", "coryat_score"]
+
+CREATE_MISMATCHES = """CREATE TABLE score_mismatches(
+    game_id INTEGER,
+    player_id INTEGER,
+    score TEXT,
+    scraped INTEGER,
+    computed INTEGER,
+    PRIMARY KEY(game_id, player_id, score)
+);"""
+
+
+def main(args):
+    if not os.path.exists(args.database):
+        print("The specified database does not exist.")
+        sys.exit(1)
+    with sqlite3.connect(args.database) as sql:
+        rank(sql)
+        check(sql)
+
+
+def rank(sql):
+    """Sets every player's place in their game from the final scores.
+
+    All the games are ranked at once: a player's place is the number of
+    players in the game who finished with at least as much as they did, so
+    tied players share the lower place. Players with no final score get no
+    place. Only the rows whose place changes are written.
+    """
+    rows = sql.execute("SELECT game_id, player_id, final_score, place FROM game_players WHERE final_score IS NOT NULL;").fetchall()
+    if not rows:
+        return 0
+    games, players, finals = (numpy.array(column, dtype=numpy.int64) for column in list(zip(*rows))[:3])
+    # Each game's players from the highest final score down
+    order = numpy.lexsort((-finals, games))
+    games, players, finals = games[order], players[order], finals[order]
+    game_start = numpy.searchsorted(games, games, side="left")
+    # Runs of players in the same game with the same final score
+    new_run = numpy.r_[True, (games[1:] != games[:-1]) | (finals[1:] != finals[:-1])]
+    run_starts = numpy.flatnonzero(new_run)
+    run_ends = numpy.r_[run_starts[1:], len(games)]
+    places = run_ends[numpy.cumsum(new_run) - 1] - game_start
+
+    current = dict(((row[0], row[1]), row[3]) for row in rows)
+    changed = [(int(place), int(game), int(player))
+               for game, player, place in zip(games, players, places)
+               if current[(int(game), int(player))] != place]
+    sql.executemany("UPDATE game_players SET place = ? WHERE game_id = ? AND player_id = ?;", changed)
+    sql.commit()
+    return len(changed)
+
+
+def check(sql):
+    """Recomputes the scores from the clues and records where they disagree.
+
+    The end of round scores add the value of every clue a player got right
+    and take away the value of every one they got wrong (for a Daily Double
+    the value is the wager), and Final Jeopardy! adds or takes away the
+    wager. The Coryat score leaves out Final Jeopardy! and wrong Daily
+    Doubles, and counts right Daily Doubles at their natural value. Every
+    scraped score that differs is saved in score_mismatches, which is
+    rebuilt each time. Returns the number of games with a mismatch.
+    """
+    game_players = numpy.array(sql.execute("SELECT game_id, player_id FROM game_players ORDER BY game_id, player_id;").fetchall(), dtype=numpy.int64).reshape(-1, 2)
+    keys = game_players[:, 0] << 32 | game_players[:, 1]
+    if not len(keys):
+        return 0
+    computed = dict((score, numpy.zeros(len(keys), dtype=numpy.int64)) for score in CHECKED_SCORES)
+
+    def add(score, games, players, amounts):
+        # Answers by anyone who isn't one of the game's players are left out
+        found = numpy.searchsorted(keys, games << 32 | players)
+        found = numpy.minimum(found, len(keys) - 1)
+        hit = keys[found] == (games << 32 | players)
+        numpy.add.at(computed[score], found[hit], amounts[hit])
+
+    # Every answer to a board clue: (game, player, round, value, is DD, row,
+    # whether the values had doubled, +1 if right or -1 if wrong)
+    answers = numpy.array(sql.execute("""
+        SELECT game_id, answer_player_id, round, value, is_daily_double, row, air_date >= ?, 1
+        FROM clues JOIN games USING(game_id)
+        WHERE round IN (1, 2) AND answer_player_id IS NOT NULL AND typeof(value) = 'integer'
+        UNION ALL
+        SELECT game_id, clue_wrong_answers.player_id, round, value, is_daily_double, row, air_date >= ?, -1
+        FROM clue_wrong_answers JOIN clues USING(clue_id) JOIN games USING(game_id)
+        WHERE round IN (1, 2) AND typeof(value) = 'integer';""", (VALUES_DOUBLED, VALUES_DOUBLED)).fetchall(), dtype=numpy.int64).reshape(-1, 8)
+    games, players, rounds, values, is_dd, rows, doubled, signs = answers.T
+    add("first_round_score", games[rounds == 1], players[rounds == 1], (signs * values)[rounds == 1])
+    add("second_round_score", games, players, signs * values)
+    add("final_score", games, players, signs * values)
+    natural = numpy.where(doubled == 1, 200, 100) * rows * rounds
+    coryat = numpy.where(is_dd == 1, numpy.where(signs > 0, natural, 0), signs * values)
+    add("coryat_score", games, players, coryat)
+
+    finals = numpy.array(sql.execute("""
+        SELECT game_id, final_jeopardy_answers.player_id, wager, is_correct
+        FROM final_jeopardy_answers JOIN clues USING(clue_id)
+        WHERE typeof(wager) = 'integer';""").fetchall(), dtype=numpy.int64).reshape(-1, 4)
+    games, players, wagers, is_correct = finals.T
+    add("final_score", games, players, numpy.where(is_correct == 1, wagers, -wagers))
+
+    mismatches = []
+    scraped = sql.execute("SELECT game_id, player_id, %s FROM game_players ORDER BY game_id, player_id;" % ", ".join(CHECKED_SCORES))
+    for i, row in enumerate(scraped):
+        for score, value in zip(CHECKED_SCORES, row[2:]):
+            if value is not None and value != computed[score][i]:
+                mismatches.append((row[0], row[1], score, value, int(computed[score][i])))
+    with sql:
+        sql.execute("DROP TABLE IF EXISTS score_mismatches;")
+        sql.execute(CREATE_MISMATCHES)
+        sql.executemany("INSERT INTO score_mismatches VALUES(?, ?, ?, ?, ?);", mismatches)
+    games = len(set(row[0] for row in mismatches))
+    print("%d games have scores that don't add up, see score_mismatches" % games)
+    return games
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Rank the players in every game and check the scraped scores against the clues.")
+    parser.add_argument("-f", "--filename", dest="database",
+                        metavar="<filename>",
+                        help="the SQLite database to check",
+                        default="output/database.db")
+    main(parser.parse_args())
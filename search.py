@@ -0,0 +1,111 @@
+#!/usr/bin/env python -OO
+# -*- coding: utf-8 -*-
+
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+# One row per clue, with the clue id as its rowid. Porter stemming so that
+# "rivers" finds "river".
+CREATE = """CREATE VIRTUAL TABLE IF NOT EXISTS clue_search USING fts5(
+    clue,
+    answer,
+    wrong_answers,
+    category,
+    tokenize = 'porter unicode61 remove_diacritics 2'
+);"""
+
+INSERT = "INSERT INTO clue_search(rowid, clue, answer, wrong_answers, category) VALUES(?, ?, ?, ?, ?);"
+
+# Run before the game's clues are deleted
+DELETE = "DELETE FROM clue_search WHERE rowid IN (SELECT clue_id FROM clues WHERE game_id = ?);"
+
+REBUILD = """INSERT INTO clue_search(rowid, clue, answer, wrong_answers, category)
+SELECT clues.clue_id, clue, clues.answer,
+    (SELECT group_concat(answer, ' / ') FROM (
+        SELECT answer FROM clue_wrong_answers WHERE clue_wrong_answers.clue_id = clues.clue_id ORDER BY rowid
+    )),
+    category
+FROM clues
+LEFT JOIN categories ON clues.category_id = categories.category_id;"""
+
+QUERY = """SELECT clues.clue_id, air_date, clue_search.category, clues.clue, clues.answer
+FROM clue_search
+JOIN clues ON clues.clue_id = clue_search.rowid
+JOIN games ON clues.game_id = games.game_id
+WHERE clue_search MATCH ?
+ORDER BY rank
+LIMIT ?;"""
+
+
+def main(args):
+    if not os.path.exists(args.database):
+        print("The specified database does not exist.")
+        sys.exit(1)
+    sql = sqlite3.connect(args.database)
+    if args.rebuild:
+        rebuild(sql)
+        print("Indexed", sql.execute("SELECT count(*) FROM clue_search;").fetchone()[0], "clues")
+    if not args.query:
+        return
+    if not has_index(sql):
+        print("The database has no search index, parse with --search or run with --rebuild.")
+        sys.exit(1)
+    start = time.perf_counter()
+    try:
+        hits = search(sql, " ".join(args.query), args.limit)
+    except sqlite3.OperationalError as e:
+        print("Couldn't search for that (%s), put words with punctuation in double quotes." % e)
+        sys.exit(1)
+    elapsed = time.perf_counter() - start
+    for clue_id, air_date, category, clue, answer in hits:
+        print("%s  %s  %s\n    %s\n    %s\n" % (clue_id, air_date, category, clue, answer))
+    print("%d hits in %.1f ms" % (len(hits), elapsed * 1000))
+
+
+def create_index(sql):
+    """Creates the clue_search table, exiting if SQLite was built without FTS5."""
+    try:
+        sql.execute(CREATE)
+    except sqlite3.OperationalError as e:
+        print("Couldn't create the search index (%s), this SQLite may not have FTS5." % e)
+        sys.exit(1)
+
+
+def has_index(sql):
+    return sql.execute("SELECT 1 FROM sqlite_master WHERE name = 'clue_search';").fetchone() is not None
+
+
+def rebuild(sql):
+    """Indexes every clue in the database from scratch."""
+    create_index(sql)
+    with sql:
+        sql.execute("DELETE FROM clue_search;")
+        sql.execute(REBUILD)
+        sql.execute("INSERT INTO clue_search(clue_search) VALUES('optimize');")
+
+
+def search(sql, query, limit=10):
+    """Returns the best matches for an FTS5 query as (clue id, air date,
+    category, clue, answer) tuples, best first."""
+    return sql.execute(QUERY, (query, limit)).fetchall()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Search the clues, answers, wrong answers and categories in the J! Archive database.")
+    parser.add_argument("query", nargs="*",
+                        help="an FTS5 query, e.g. river, \"new york\", category:opera or answer:paris")
+    parser.add_argument("-f", "--filename", dest="database",
+                        metavar="<filename>",
+                        help="the SQLite database to search",
+                        default="output/database.db")
+    parser.add_argument("-n", "--limit", dest="limit", metavar="<number>",
+                        type=int, default=10,
+                        help="the number of hits shown")
+    parser.add_argument("--rebuild",
+                        help="(re)build the search index from the database first",
+                        action="store_true")
+    main(parser.parse_args())